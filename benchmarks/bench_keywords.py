@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Keyword matcher micro-benchmark.
+Compares the compiled KeywordMatcher against the old per-keyword loop
+(`keyword.lower() in text.lower()`) for keyword lists of 15 to 5,000 entries.
+
+Run from the repo root: python benchmarks/bench_keywords.py
+"""
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import KEYWORDS, KeywordMatcher  # noqa: E402
+
+SIZES = [15, 100, 500, 1000, 5000]
+MESSAGES = 200
+REPEAT = 5
+
+def make_keywords(n: int, rng: random.Random) -> list:
+    words = list(KEYWORDS)
+    while len(words) < n:
+        words.append("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10))))
+    return words[:n]
+
+def make_messages(keywords: list, rng: random.Random) -> list:
+    messages = []
+    for _ in range(MESSAGES):
+        words = ["".join(rng.choice(string.ascii_letters) for _ in range(rng.randint(2, 8)))
+                 for _ in range(rng.randint(5, 40))]
+        if rng.random() < 0.2:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords).upper())
+        messages.append(" ".join(words))
+    return messages
+
+def old_loop(keywords: list, text: str):
+    lowered = text.lower()
+    for keyword in keywords:
+        if keyword.lower() in lowered:
+            return keyword
+    return None
+
+def bench(size: int):
+    rng = random.Random(size)
+    keywords = make_keywords(size, rng)
+    messages = make_messages(keywords, rng)
+    matcher = KeywordMatcher(keywords)
+
+    def run_old():
+        for text in messages:
+            old_loop(keywords, text)
+
+    def run_new():
+        for text in messages:
+            matcher.find(text)
+
+    old = min(timeit.repeat(run_old, number=1, repeat=REPEAT)) / MESSAGES
+    new = min(timeit.repeat(run_new, number=1, repeat=REPEAT)) / MESSAGES
+    build = min(timeit.repeat(lambda: KeywordMatcher(keywords), number=1, repeat=REPEAT))
+    return old, new, build
+
+def main():
+    print(f"{'keywords':>9} {'loop us/msg':>12} {'automaton us/msg':>17} {'speedup':>8} {'build ms':>9}")
+    for size in SIZES:
+        old, new, build = bench(size)
+        print(f"{size:>9} {old * 1e6:>12.1f} {new * 1e6:>17.1f} {old / new:>7.1f}x {build * 1e3:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,617 @@
+# -*- coding: utf-8 -*-
+"""
+Offline load test for bot.py.
+- Fake Telegram Bot API (getUpdates, sendMessage, editMessageText, forwardMessage,
+  sendPhoto, ...) with configurable latency and error injection
+- Stub servers standing in for CHATGPT_API_URL, GEMINI3_API, DEEPSEEK_API, INSTA_API and FF_API
+- Replays a synthetic update mix (private chats, keyword-heavy group traffic,
+  button flows, broadcasts) through the Application from bot.build_app(),
+  polling the fake API exactly like production does
+- Reports updates/sec, p50/p95/p99 handler latency and outbound call counts
+
+Bot state (hinata.db, journal, logs) is written to a temporary directory.
+The fake API does not enforce Telegram's per-group limit, so the bot's own
+OUTBOUND_GROUP_RATE is lifted unless --group-rate is given; otherwise inbox
+forwards to a single group would take minutes to drain.
+
+Examples (from the repo root):
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --updates 5000 --mix private=2,group=6,buttons=1,broadcast=0.01
+    python benchmarks/loadtest.py --tg-latency 50 --tg-errors 429=0.01,502=0.01 --json
+"""
+import argparse
+import asyncio
+import email.parser
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qsl, unquote_plus, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Hinata", "username": "hinata_load_bot",
+            "can_join_groups": True, "can_read_all_group_messages": True, "supports_inline_queries": False}
+SETUP_METHODS = {"getMe", "getUpdates", "deleteWebhook", "setWebhook", "logOut", "close"}
+MEDIA_METHODS = {"sendPhoto": "photo", "sendVideo": "video", "sendDocument": "document"}
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 429: "Too Many Requests",
+           500: "Internal Server Error", 502: "Bad Gateway"}
+DEFAULT_MIX = "private=4,group=4,buttons=1,broadcast=0.02"
+
+# ================= Minimal HTTP/1.1 server (keep-alive) =================
+class StubServer:
+    def __init__(self, handler):
+        self.handler = handler
+        self.port = None
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                body = await reader.readexactly(length) if length else b""
+                status, content_type, payload = await self.handler(method, target, headers, body)
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    "Connection: keep-alive\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+def parse_params(headers: dict, body: bytes) -> dict:
+    content_type = headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+        )
+        params = {}
+        for part in message.get_payload() if message.is_multipart() else []:
+            name = part.get_param("name", header="content-disposition")
+            if name and not part.get_filename():
+                params[name] = part.get_payload(decode=True).decode("utf-8", "replace")
+        return params
+    return dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+
+def parse_errors(spec: str) -> dict:
+    errors = {}
+    for item in filter(None, (spec or "").split(",")):
+        code, _, rate = item.partition("=")
+        errors[int(code)] = float(rate)
+    return errors
+
+def jittered(rng: random.Random, latency_ms: float, jitter_ms: float) -> float:
+    return max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000
+
+# ================= Fake Telegram Bot API =================
+class FakeTelegram:
+    def __init__(self, rng: random.Random, latency_ms: float, jitter_ms: float, errors: dict):
+        self.rng = rng
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.errors = errors
+        self.calls = Counter()
+        self.injected = Counter()
+        self.pending = deque()
+        self.delivered = {}
+        self._arrived = asyncio.Event()
+        self._message_id = 1000
+        self._file_id = 0
+
+    def push(self, update: dict):
+        self.pending.append(update)
+        self._arrived.set()
+
+    async def handle(self, method, target, headers, body):
+        name = urlsplit(target).path.rsplit("/", 1)[-1]
+        params = parse_params(headers, body)
+        self.calls[name] += 1
+        if name == "getUpdates":
+            return self._ok(await self.get_updates(params))
+        await asyncio.sleep(jittered(self.rng, self.latency_ms, self.jitter_ms))
+        if name not in SETUP_METHODS:
+            for code, rate in self.errors.items():
+                if self.rng.random() < rate:
+                    self.injected[f"{name}:{code}"] += 1
+                    return self._error(code)
+        return self._ok(self.result(name, params))
+
+    async def get_updates(self, params: dict) -> list:
+        if not self.pending:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get("limit") or 100)
+        batch = []
+        now = time.perf_counter()
+        while self.pending and len(batch) < limit:
+            update = self.pending.popleft()
+            self.delivered[update["update_id"]] = now
+            batch.append(update)
+        return batch
+
+    def _message(self, params: dict) -> dict:
+        self._message_id += 1
+        chat_id = params.get("chat_id", 0)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            chat_id = 0
+        chat = {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}
+        if chat_id <= 0:
+            chat["title"] = f"Load group {chat_id}"
+        message = {"message_id": self._message_id, "date": int(time.time()), "chat": chat, "from": BOT_USER}
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        return message
+
+    def _file(self, kind: str) -> dict:
+        self._file_id += 1
+        file = {"file_id": f"{kind}-{self._file_id}", "file_unique_id": f"u{self._file_id}"}
+        if kind == "photo":
+            return [dict(file, width=640, height=640)]
+        if kind == "video":
+            return dict(file, width=640, height=360, duration=5)
+        return file
+
+    def result(self, name: str, params: dict):
+        if name == "getMe":
+            return BOT_USER
+        if name in ("sendMessage", "editMessageText", "editMessageCaption", "forwardMessage"):
+            if name.startswith("edit") and "inline_message_id" in params:
+                return True
+            return self._message(params)
+        if name in MEDIA_METHODS:
+            kind = MEDIA_METHODS[name]
+            message = self._message(params)
+            message[kind] = self._file(kind)
+            return message
+        if name == "sendMediaGroup":
+            items = json.loads(params.get("media") or "[]")
+            messages = []
+            for item in items:
+                message = self._message(params)
+                kind = item.get("type", "photo")
+                message[kind] = self._file(kind)
+                messages.append(message)
+            return messages
+        if name == "copyMessage":
+            self._message_id += 1
+            return {"message_id": self._message_id}
+        return True
+
+    def _ok(self, result):
+        return 200, "application/json", json.dumps({"ok": True, "result": result}).encode()
+
+    def _error(self, code: int):
+        if code == 429:
+            payload = {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                       "parameters": {"retry_after": 1}}
+        elif code == 400:
+            payload = {"ok": False, "error_code": 400, "description": "Bad Request: chat not found"}
+        elif code == 403:
+            payload = {"ok": False, "error_code": 403, "description": "Forbidden: bot was kicked from the group chat"}
+        else:
+            return code, "text/plain", REASONS.get(code, "Error").encode()
+        return code, "application/json", json.dumps(payload).encode()
+
+# ================= Stub AI / lookup backends =================
+class StubBackends:
+    def __init__(self, rng: random.Random, latency_ms: float, jitter_ms: float, error_rate: float, reply_chars: int):
+        self.rng = rng
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.reply_chars = reply_chars
+        self.calls = Counter()
+        self.base_url = None
+
+    async def handle(self, method, target, headers, body):
+        parts = urlsplit(target)
+        name = parts.path.strip("/")
+        query = dict(parse_qsl(parts.query, keep_blank_values=True))
+        self.calls[name] += 1
+        await asyncio.sleep(jittered(self.rng, self.latency_ms, self.jitter_ms))
+        if self.rng.random() < self.error_rate:
+            return 500, "text/plain", b"upstream error"
+        if name == "deepseek":
+            return 200, "text/plain; charset=utf-8", self._reply(query.get("q", "")).encode()
+        if name == "chatgpt":
+            data = {"reply": self._reply(query.get("text", ""))}
+        elif name == "gemini":
+            data = {"response": self._reply(query.get("prompt", ""))}
+        elif name == "insta":
+            username = query.get("username", "")
+            data = {"status": "ok", "profile": {
+                "full_name": username.title(), "username": username, "biography": "load test profile",
+                "followers": self.rng.randint(0, 10 ** 6), "following": self.rng.randint(0, 5000),
+                "posts": self.rng.randint(0, 3000), "account_creation_year": 2015, "is_verified": False,
+                "profile_pic_url_hd": f"{self.base_url}/pics/{username}.jpg?sig={self.rng.random()}",
+            }}
+        elif name == "ff":
+            uid = query.get("uid", "")
+            data = {"basicInfo": {"accountId": uid, "nickname": f"player{uid[-4:]}", "level": self.rng.randint(1, 80),
+                                  "region": "BD", "liked": self.rng.randint(0, 99999)}}
+        else:
+            return 404, "text/plain", b"not found"
+        return 200, "application/json", json.dumps(data).encode()
+
+    def _reply(self, prompt: str) -> str:
+        words = unquote_plus(prompt).split() or ["hello"]
+        text = []
+        while sum(len(w) + 1 for w in text) < self.reply_chars:
+            text.append(self.rng.choice(words))
+        return " ".join(text)
+
+# ================= Synthetic update mix =================
+class UpdateFactory:
+    def __init__(self, rng: random.Random, owner_id: int, keywords: list, users: int, groups: int,
+                 keyword_ratio: float):
+        self.rng = rng
+        self.owner_id = owner_id
+        self.keywords = keywords or ["hinata"]
+        self.users = [100000 + i for i in range(users)]
+        self.groups = [-1001000000000 - i for i in range(groups)]
+        self.keyword_ratio = keyword_ratio
+        self._message_id = 0
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def _private(self, user_id: int) -> dict:
+        return {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+
+    def _group(self, chat_id: int) -> dict:
+        return {"id": chat_id, "type": "supergroup", "title": f"Load group {chat_id}"}
+
+    def message(self, chat: dict, user_id: int, text: str) -> dict:
+        self._message_id += 1
+        message = {"message_id": self._message_id, "date": int(time.time()), "chat": chat,
+                   "from": self._user(user_id), "text": text}
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"message": message}
+
+    def callback(self, chat: dict, user_id: int, data: str) -> dict:
+        self._message_id += 1
+        return {"callback_query": {
+            "id": f"cb{self._message_id}", "from": self._user(user_id), "chat_instance": str(chat["id"]),
+            "data": data, "message": {"message_id": self._message_id, "date": int(time.time()),
+                                      "chat": chat, "from": BOT_USER, "text": "menu"},
+        }}
+
+    def _words(self, n: int) -> str:
+        return " ".join(self.rng.choice(["ok", "lol", "bro", "match", "tonight", "who", "is", "online", "gg",
+                                         "rank", "push", "anyone", "free", "fire", "bot"]) for _ in range(n))
+
+    def _username(self) -> str:
+        return f"creator{self.rng.randint(1, 200)}"
+
+    def _uid(self) -> str:
+        return str(self.rng.randint(10 ** 9, 10 ** 9 + 500))
+
+    def private_session(self) -> list:
+        user_id = self.rng.choice(self.users)
+        chat = self._private(user_id)
+        kind = self.rng.choice(["chat", "chat", "start", "ping", "gemini", "deepseek", "insta", "ff"])
+        if kind == "chat":
+            return [self.message(chat, user_id, self._words(self.rng.randint(3, 15)))]
+        if kind in ("start", "ping"):
+            return [self.message(chat, user_id, f"/{kind}")]
+        if kind in ("gemini", "deepseek"):
+            return [self.message(chat, user_id, f"/{kind} {self._words(self.rng.randint(3, 12))}")]
+        if kind == "insta":
+            return [self.message(chat, user_id, "/insta"), self.message(chat, user_id, self._username())]
+        return [self.message(chat, user_id, "/ff"), self.message(chat, user_id, self._uid())]
+
+    def group_session(self) -> list:
+        chat = self._group(self.rng.choice(self.groups))
+        text = self._words(self.rng.randint(3, 25))
+        if self.rng.random() < self.keyword_ratio:
+            words = text.split()
+            words.insert(self.rng.randrange(len(words) + 1), self.rng.choice(self.keywords))
+            text = " ".join(words)
+        return [self.message(chat, self.rng.choice(self.users), text)]
+
+    def buttons_session(self) -> list:
+        user_id = self.rng.choice(self.users)
+        chat = self._private(user_id)
+        button = self.rng.choice(["btn_gemini", "btn_deepseek", "btn_insta", "btn_ff", "btn_ping", "btn_help"])
+        session = [self.message(chat, user_id, "/start"), self.callback(chat, user_id, button)]
+        if button in ("btn_gemini", "btn_deepseek"):
+            session.append(self.message(chat, user_id, self._words(self.rng.randint(3, 12))))
+        elif button == "btn_insta":
+            session.append(self.message(chat, user_id, self._username()))
+        elif button == "btn_ff":
+            session.append(self.message(chat, user_id, self._uid()))
+        return session
+
+    def broadcast_session(self) -> list:
+        chat = self._private(self.owner_id)
+        return [self.message(chat, self.owner_id, f"/broadcastall {self._words(8)}")]
+
+    def generate(self, total: int, mix: dict) -> list:
+        makers = {"private": self.private_session, "group": self.group_session,
+                  "buttons": self.buttons_session, "broadcast": self.broadcast_session}
+        names = [name for name in mix if mix[name] > 0]
+        weights = [mix[name] for name in names]
+        sessions = []
+        count = 0
+        while count < total:
+            session = makers[self.rng.choices(names, weights)[0]]()
+            sessions.append(deque(session))
+            count += len(session)
+        # Interleave sessions while keeping each session's own order.
+        updates = []
+        while sessions:
+            index = self.rng.randrange(len(sessions))
+            updates.append(sessions[index].popleft())
+            if not sessions[index]:
+                sessions[index] = sessions[-1]
+                sessions.pop()
+        for update_id, update in enumerate(updates[:total], start=1):
+            update["update_id"] = update_id
+        return updates[:total]
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for item in filter(None, spec.split(",")):
+        name, _, weight = item.partition("=")
+        if name not in ("private", "group", "buttons", "broadcast"):
+            raise SystemExit(f"Unknown mix entry: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+# ================= Driver =================
+class Probe:
+    """Wraps bot.instrumented so every handled update reports its latency."""
+
+    def __init__(self, telegram: FakeTelegram, total: int):
+        self.telegram = telegram
+        self.total = total
+        self.handler_latency = []
+        self.end_to_end = []
+        self.failed = 0
+        self.first_done = None
+        self.last_done = None
+        self.done = asyncio.Event()
+
+    def install(self, bot):
+        original = bot.instrumented
+
+        def probed(callback):
+            handler = original(callback)
+
+            @functools.wraps(handler)
+            async def wrapper(update, context):
+                started = time.perf_counter()
+                try:
+                    return await handler(update, context)
+                except Exception:
+                    self.failed += 1
+                    raise
+                finally:
+                    self._handled(update, started)
+
+            return wrapper
+
+        bot.instrumented = probed
+
+    def _handled(self, update, started: float):
+        now = time.perf_counter()
+        self.handler_latency.append(now - started)
+        delivered = self.telegram.delivered.get(update.update_id)
+        if delivered is not None:
+            self.end_to_end.append(now - delivered)
+        self.first_done = self.first_done or now
+        self.last_done = now
+        if len(self.handler_latency) >= self.total:
+            self.done.set()
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index] * 1000, 2)
+
+def backlog(bot) -> dict:
+    left = {f"outbound_{name}": n for name, n in bot.outbound.depths().items() if n}
+    if bot.outbound.inflight:
+        left["outbound_inflight"] = bot.outbound.inflight
+    if bot.inbox.queue.qsize():
+        left["inbox"] = bot.inbox.queue.qsize()
+    broadcasts = sum(not task.done() for task in bot._broadcast_tasks.values())
+    if broadcasts:
+        left["broadcasts"] = broadcasts
+    return left
+
+async def settle(telegram: FakeTelegram, bot, quiet: float, deadline: float) -> dict:
+    # Background work (broadcasts, inbox digests, queued outbound sends) keeps
+    # calling Telegram after the last handler returns; wait until every queue
+    # has drained and outbound traffic goes quiet. Returns whatever was still
+    # queued when the deadline hit.
+    last = -1
+    while time.monotonic() < deadline:
+        current = sum(telegram.calls.values()) - telegram.calls["getUpdates"]
+        if current == last and not backlog(bot):
+            return {}
+        last = current
+        await asyncio.sleep(quiet)
+    return backlog(bot)
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="hinata-load-")
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import bot  # noqa: E402 - imported after chdir so all state files land in the temp dir
+    from telegram import Update
+
+    logging.getLogger().setLevel(args.log_level.upper())
+    bot.STATUS_SERVER_ENABLED = False
+    if args.group_rate:
+        bot.OUTBOUND_GROUP_RATE = args.group_rate / 60
+    else:
+        bot.OUTBOUND_GROUP_RATE = bot.OUTBOUND_GROUP_BURST = 1e9
+
+    telegram = FakeTelegram(rng, args.tg_latency, args.tg_jitter, parse_errors(args.tg_errors))
+    backends = StubBackends(rng, args.backend_latency, args.backend_jitter, args.backend_errors, args.reply_chars)
+    tg_server = StubServer(telegram.handle)
+    backend_server = StubServer(backends.handle)
+    await tg_server.start()
+    await backend_server.start()
+    base = backends.base_url = f"http://127.0.0.1:{backend_server.port}"
+    bot.CHATGPT_API_URL = base + "/chatgpt?text={prompt}"
+    bot.GEMINI3_API = base + "/gemini?prompt={}"
+    bot.DEEPSEEK_API = base + "/deepseek?q={}"
+    bot.INSTA_API = base + "/insta?username={}"
+    bot.FF_API = base + "/ff?uid={}"
+
+    factory = UpdateFactory(rng, bot.OWNER_ID, list(bot.keyword_watcher.get().keywords),
+                            args.users, args.groups, args.keyword_ratio)
+    updates = factory.generate(args.updates, parse_mix(args.mix))
+    probe = Probe(telegram, len(updates))
+    probe.install(bot)
+
+    app = bot.build_app(TOKEN, base_url=f"http://127.0.0.1:{tg_server.port}/bot")
+    await app.initialize()
+    await app.post_init(app)
+    for group_id in factory.groups:
+        await bot.store.add_group(group_id)
+    await app.updater.start_polling(poll_interval=0, timeout=5, allowed_updates=Update.ALL_TYPES)
+    await app.start()
+
+    started = time.perf_counter()
+    deadline = time.monotonic() + args.timeout
+    for update in updates:
+        telegram.push(update)
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+    try:
+        await asyncio.wait_for(probe.done.wait(), timeout=max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        pass
+    finished = probe.last_done or time.perf_counter()
+    unsettled = await settle(telegram, bot, args.settle, deadline)
+
+    await app.updater.stop()
+    await app.stop()
+    await app.post_stop(app)
+    await app.shutdown()
+    await app.post_shutdown(app)
+    await tg_server.stop()
+    await backend_server.stop()
+
+    elapsed = max(finished - started, 1e-9)
+    handled = len(probe.handler_latency)
+    outbound = {name: n for name, n in sorted(telegram.calls.items()) if name not in SETUP_METHODS}
+    return {
+        "updates": len(updates),
+        "handled": handled,
+        "handler_errors": probe.failed,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(handled / elapsed, 1),
+        "handler_latency_ms": {f"p{q}": percentile(probe.handler_latency, q) for q in (50, 95, 99)},
+        "end_to_end_latency_ms": {f"p{q}": percentile(probe.end_to_end, q) for q in (50, 95, 99)},
+        "telegram_calls": outbound,
+        "telegram_calls_total": sum(outbound.values()),
+        "get_updates_calls": telegram.calls["getUpdates"],
+        "injected_errors": dict(telegram.injected),
+        "backend_calls": dict(sorted(backends.calls.items())),
+        "unsettled": unsettled,
+        "workdir": workdir,
+    }
+
+def print_report(report: dict):
+    print(f"updates           {report['handled']}/{report['updates']} handled, {report['handler_errors']} handler errors")
+    print(f"elapsed           {report['elapsed_s']} s")
+    print(f"throughput        {report['updates_per_s']} updates/s")
+    for label, key in (("handler latency", "handler_latency_ms"), ("end-to-end", "end_to_end_latency_ms")):
+        stats = report[key]
+        print(f"{label:<17} p50 {stats['p50']} ms  p95 {stats['p95']} ms  p99 {stats['p99']} ms")
+    print(f"telegram calls    {report['telegram_calls_total']} (getUpdates {report['get_updates_calls']})")
+    for name, count in report["telegram_calls"].items():
+        print(f"  {name:<20} {count}")
+    if report["injected_errors"]:
+        print("injected errors")
+        for name, count in sorted(report["injected_errors"].items()):
+            print(f"  {name:<20} {count}")
+    print("backend calls")
+    for name, count in report["backend_calls"].items():
+        print(f"  {name:<20} {count}")
+    if report["unsettled"]:
+        print("still queued at timeout")
+        for name, count in report["unsettled"].items():
+            print(f"  {name:<20} {count}")
+    print(f"state kept in     {report['workdir']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the Hinata bot.")
+    parser.add_argument("--updates", type=int, default=2000, help="number of synthetic updates to replay")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="session weights: private, group, buttons, broadcast")
+    parser.add_argument("--rate", type=float, default=0, help="updates/second to inject (0 = all at once)")
+    parser.add_argument("--users", type=int, default=500, help="distinct synthetic users")
+    parser.add_argument("--groups", type=int, default=50, help="groups the bot is in (broadcast fan-out)")
+    parser.add_argument("--keyword-ratio", type=float, default=0.3, help="share of group messages containing a keyword")
+    parser.add_argument("--tg-latency", type=float, default=20, help="fake Bot API latency in ms")
+    parser.add_argument("--tg-jitter", type=float, default=10, help="fake Bot API latency jitter in ms")
+    parser.add_argument("--tg-errors", default="", help="injected Bot API errors, e.g. 429=0.01,502=0.005,400=0.001")
+    parser.add_argument("--backend-latency", type=float, default=300, help="stub backend latency in ms")
+    parser.add_argument("--backend-jitter", type=float, default=150, help="stub backend latency jitter in ms")
+    parser.add_argument("--backend-errors", type=float, default=0.0, help="share of backend calls answered with HTTP 500")
+    parser.add_argument("--reply-chars", type=int, default=800, help="approximate AI reply length")
+    parser.add_argument("--group-rate", type=float, default=0,
+                        help="per-group messages/minute the bot allows itself (0 = unlimited, bot default is 20)")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds of outbound silence that end the run")
+    parser.add_argument("--timeout", type=float, default=300, help="give up after this many seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="critical", help="bot log level during the run")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
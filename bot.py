@@ -7,19 +7,49 @@ Hinata Bot - Final (httpx, inline buttons, restored features)
 - Deployable to Render (use python 3.11 recommended)
 """
 import asyncio
+import atexit
+import contextlib
+import contextvars
+import cProfile
+import csv
+import functools
+import glob
+import gzip
+import hashlib
+import html
+import io
 import logging
 import json
 import os
+import pstats
+import queue
+import secrets
+import shutil
+import signal
+import sqlite3
 import time
-from datetime import timedelta
+import tracemalloc
+import unicodedata
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import httpx
+from telegram.error import BadRequest, ChatMigrated, Forbidden, RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
 from telegram import (
     Update,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
 )
 from telegram.ext import (
     ApplicationBuilder,
+    BaseRateLimiter,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     filters,
@@ -46,13 +76,30 @@ FORWARD_USER2_GROUP_ID = -1002536019847
 SOURCE_GROUP_ID = -4767799138
 DESTINATION_GROUP_ID = -1002510490386
 
+# Routing table: messages from a tracked user, or posted in a source chat, are
+# fanned out to every listed destination. routes.json (same shape, string keys)
+# overrides these defaults.
+ROUTES_FILE = "routes.json"
+DEFAULT_ROUTES = {
+    "users": {TRACKED_USER1_ID: [FORWARD_USER1_GROUP_ID], TRACKED_USER2_ID: [FORWARD_USER2_GROUP_ID]},
+    "chats": {SOURCE_GROUP_ID: [DESTINATION_GROUP_ID]},
+}
+
 KEYWORDS = [
     "shawon", "shawn", "sn", "@shawonxnone", "shwon", "shaun", "sahun", "sawon",
     "sawn", "nusu", "nusrat", "saun", "ilma", "izumi", "🎀꧁𖨆❦︎ 𝑰𝒁𝑼𝑴𝑰 𝑼𝒄𝒉𝒊𝒉𝒂 ❦︎𖨆꧂🎀"
 ]
 
+# Optional JSON list that overrides KEYWORDS; re-read automatically when it changes.
+KEYWORDS_FILE = "keywords.json"
+KEYWORDS_RELOAD_CHECK = 5.0  # seconds between mtime checks
+
 LOG_FILE = "hinata.log"
-MAX_LOG_SIZE = 200 * 1024  # 200 KB
+MAX_LOG_SIZE = 1024 * 1024  # rotate hinata.log at 1 MB
+LOG_BACKUP_COUNT = 5  # gzip-compressed hinata.log.N.gz files kept
+LOG_JSON = os.environ.get("LOG_JSON", "") == "1"  # structured JSON lines instead of text
+LOG_QUEUE_SIZE = 10000  # records beyond this are dropped rather than blocking
+SLOW_HANDLER_SECONDS = 2.0  # handlers slower than this are logged at INFO
 
 # Old ChatGPT style API (kept for compatibility)
 CHATGPT_API_URL = "https://addy-chatgpt-api.vercel.app/?text={prompt}"
@@ -63,15 +110,205 @@ DEEPSEEK_API = "https://void-deep.hosters.club/api/?q={}"
 INSTA_API = "https://instagram-api-ashy.vercel.app/api/ig-profile.php?username={}"
 FF_API = "http://danger-info-alpha.vercel.app/accinfo?uid={}&key=DANGERxINFO"
 
+# ================= HTTP client settings =================
+# One pooled client per backend, created at startup and closed at shutdown.
+HTTP_MAX_CONNECTIONS = 50
+HTTP_MAX_KEEPALIVE = 20
+HTTP_KEEPALIVE_EXPIRY = 60.0  # seconds an idle connection is kept open
+HTTP2_ENABLED = False  # needs the optional "h2" package (pip install httpx[http2])
+HTTP_CONNECT_TIMEOUT = 10.0
+BACKEND_TIMEOUTS = {
+    "chatgpt": 30.0,
+    "gemini": 30.0,
+    "deepseek": 30.0,
+    "insta": 15.0,
+    "ff": 15.0,
+}
+DEFAULT_BACKEND_TIMEOUT = 30.0
+
+# ================= Backend resilience settings =================
+CIRCUIT_FAILURE_THRESHOLD = 5  # consecutive failures before a backend is skipped
+CIRCUIT_RESET_TIMEOUT = 60.0  # seconds before a half-open trial request
+LATENCY_WINDOW = 100  # recent successful calls kept per backend for p95
+HEDGE_MIN_SAMPLES = 10
+HEDGE_MIN_DELAY = 1.5  # never hedge sooner than this many seconds
+AI_DEFAULT_MODE = "stream"  # /ai mode: "stream" or "race"
+
+# ================= AI admission control =================
+AI_CONCURRENCY = {"chatgpt": 4, "gemini": 4, "deepseek": 4}  # upstream calls in flight per backend
+AI_MAX_QUEUE = 100  # waiting requests per backend before new ones are refused
+AI_USER_RATE = 1 / 3  # tokens per second per user (one AI call every 3 s on average)
+AI_USER_BURST = 4
+AI_QUEUE_UPDATE_INTERVAL = 3.0  # seconds between queue-position refreshes
+
+# ================= Lookup cache settings =================
+LOOKUP_CACHE_SIZE = 1000  # entries per backend
+LOOKUP_CACHE_TTL = {
+    "insta": 10 * 60,  # seconds
+    "ff": 5 * 60,
+}
+BATCH_LOOKUP_MAX = 200  # usernames/UIDs per batch
+BATCH_LOOKUP_CONCURRENCY = 10  # lookups in flight per batch
+BATCH_LOOKUP_FILE_MAX = 256 * 1024  # bytes accepted from an uploaded list
+BATCH_PROGRESS_INTERVAL = 2.0  # seconds between progress edits
+
+# ================= Storage =================
+DB_FILE = "hinata.db"
+INSTA_PIC_CACHE_TTL = 7 * 24 * 3600  # seconds a cached profile picture file_id is reused
+INSTA_PIC_CACHE_MAX = 5000  # cached profile pictures kept (least recently used evicted)
+
+# Opt-in on-disk cache of AI answers keyed by backend + normalized prompt.
+PROMPT_CACHE_ENABLED = os.environ.get("PROMPT_CACHE", "") == "1"
+PROMPT_CACHE_TTL = {"chatgpt": 6 * 3600, "gemini": 6 * 3600, "deepseek": 6 * 3600}
+PROMPT_CACHE_MAX = {"chatgpt": 2000, "gemini": 2000, "deepseek": 2000}
+LEGACY_USERS_FILE = "users.json"
+LEGACY_GROUPS_FILE = "groups.json"
+
+# ================= Conversation state (button/command flows) =================
+CONVERSATION_TTL = 10 * 60  # seconds a pending prompt (after a button press) stays valid
+CONVERSATION_MAX_USERS = 10000  # pending flows kept; the least recently started are evicted
+CONVERSATION_SWEEP_INTERVAL = 60  # seconds between expiry sweeps
+CONVERSATION_PERSIST = os.environ.get("CONVERSATION_PERSIST", "1") == "1"  # keep pending flows across restarts
+
+# ================= Paginated results =================
+PAGE_CHARS = 3500  # body characters per page (Telegram's hard limit is 4096)
+RESULT_STORE_MAX = 500  # long results kept for paging
+RESULT_STORE_TTL = 3600  # seconds a stored result can be paged
+
+# ================= Broadcast settings =================
+BROADCAST_JOBS_FILE = "broadcast_jobs.json"
+BROADCAST_CONCURRENCY = 8  # sends in flight at once
+BROADCAST_GLOBAL_RATE = 25.0  # messages/second, Telegram allows ~30/s per bot
+BROADCAST_BURST = 25
+BROADCAST_PER_CHAT_INTERVAL = 3.0  # seconds between sends to one group (~20/min)
+BROADCAST_MAX_RETRIES = 3
+BROADCAST_PROGRESS_INTERVAL = 3.0  # seconds between progress edits / job saves
+BROADCAST_UPLOAD_ATTEMPTS = 3  # sequential sends tried to obtain media file_ids before fanning out
+
+# ================= Outbound send scheduler =================
+# Every chat-bound Bot API call is queued by priority: user replies > owner
+# alerts > forwards > broadcasts.
+OUTBOUND_RATE = 30.0  # calls/second across all chats
+OUTBOUND_BURST = 30
+OUTBOUND_CONCURRENCY = 32  # calls in flight at once
+OUTBOUND_GROUP_RATE = 20 / 60  # new messages/second per group (~20/min); private chats only share the global rate
+OUTBOUND_GROUP_BURST = 5
+OUTBOUND_MAX_RETRIES = 3  # RetryAfter requeues before the error reaches the caller
+
+# ================= Profiling (owner, on demand) =================
+# Nothing is hooked in until an owner command starts it.
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP = 40
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds of CPU time between stack samples in "sample" mode
+TRACEMALLOC_FRAMES = 10
+
+# ================= Chat delivery health =================
+CHAT_DEAD_THRESHOLD = 5  # consecutive chat-level/transport failures before a chat counts as dead
+DEAD_CHAT_POLICY = "prune"  # "prune" removes dead groups from the store, "skip" only skips them
+CHAT_HEALTH_SUCCESS_WRITE = 3600  # seconds between persisting last_success for healthy chats
+
+# ================= Status server (healthz / metrics) =================
+STATUS_SERVER_ENABLED = True
+STATUS_HOST = "0.0.0.0"
+STATUS_PORT = int(os.environ.get("PORT", "8080"))  # Render injects $PORT for web services
+TELEGRAM_POOL_SIZE = 256
+
+# ================= Update ingestion =================
+# "polling" or "webhook"; webhook mode serves updates on the status server port.
+UPDATE_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL") or os.environ.get("RENDER_EXTERNAL_URL", "")
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+MAX_CONCURRENT_UPDATES = 32  # updates handled in parallel across different chats
+MAX_PENDING_UPDATES = 10000  # updates allowed to wait on their chat's lock
+
+# ================= Inbox forwarding =================
+INBOX_QUEUE_SIZE = 500  # oldest pending forward is dropped beyond this
+INBOX_DIGEST_ENABLED = True
+INBOX_DIGEST_THRESHOLD = 5  # queued items that trigger one combined caption
+INBOX_DIGEST_MAX = 20
+INBOX_DIGEST_EXCERPT = 300  # message chars shown per digest entry; longer texts are also forwarded
+
+# ================= Interaction journal =================
+JOURNAL_ENABLED = True
+JOURNAL_FILE = "requests.jsonl"
+JOURNAL_FLUSH_RECORDS = 200  # flush when this many records are buffered...
+JOURNAL_FLUSH_MS = 1000  # ...or at least this often
+JOURNAL_SEGMENT_BYTES = 8 * 1024 * 1024  # active file is sealed into a segment past this
+JOURNAL_KEEP_SEGMENTS = 30  # raw sealed (gzip) segments kept; older ones are compacted
+# Compacted segments become per-hour aggregates (count, errors, latency, bytes per
+# kind/backend/handler) appended to requests-hourly.jsonl.gz; per-user detail is dropped.
+
 # ================= Logging =================
+# Handler/chat of the update currently being processed; set by instrumented().
+update_context = contextvars.ContextVar("update_context", default=None)
+
+class UpdateContextFilter(logging.Filter):
+    def filter(self, record):
+        ctx = update_context.get()
+        if ctx is not None:
+            record.handler = ctx.get("handler")
+            record.chat_id = ctx.get("chat_id")
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    FIELDS = ("handler", "chat_id", "latency_ms")
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
 def setup_logger():
-    if os.path.exists(LOG_FILE) and os.path.getsize(LOG_FILE) > MAX_LOG_SIZE:
-        open(LOG_FILE, "w").close()
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(message)s",
-        handlers=[logging.FileHandler(LOG_FILE), logging.StreamHandler()]
+    # Records go through a bounded queue; file/console I/O happens on the
+    # listener thread so the event loop never blocks on logging.
+    if LOG_JSON:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+    file_handler = RotatingFileHandler(
+        LOG_FILE, maxBytes=MAX_LOG_SIZE, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True
     )
+    file_handler.namer = lambda name: name + ".gz"
+    file_handler.rotator = _gzip_rotator
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(UpdateContextFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per request otherwise
+
+    listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
     return logging.getLogger("hinata")
 
 logger = setup_logger()
@@ -95,11 +332,165 @@ def read_json(path, default=None):
 def write_json(path, data):
     try:
         os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
     except Exception:
         logger.exception("Failed to write JSON: %s", path)
 
+# ================= SQLite Store =================
+class Store:
+    """SQLite (WAL) storage. All queries run on one dedicated worker thread
+    so the event loop never blocks on disk; membership checks are answered
+    from in-memory sets."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.users = set()
+        self.groups = set()
+        self.health = {}
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hinata-db")
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def execute(self, sql: str, params=()):
+        return await self.run(self._execute, sql, params)
+
+    async def fetchall(self, sql: str, params=()):
+        return await self.run(self._fetchall, sql, params)
+
+    def _execute(self, sql, params):
+        with self._conn:
+            return self._conn.execute(sql, params).rowcount
+
+    def _fetchall(self, sql, params):
+        return self._conn.execute(sql, params).fetchall()
+
+    async def open(self):
+        if self._conn is None:
+            await self.run(self._open)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, added_at REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS groups (id INTEGER PRIMARY KEY, added_at REAL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_health ("
+                "chat_id INTEGER PRIMARY KEY, consecutive_failures INTEGER NOT NULL DEFAULT 0, "
+                "last_error TEXT, last_error_at REAL, last_success_at REAL, migrated_to INTEGER, "
+                "dead INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prompt_cache ("
+                "backend TEXT NOT NULL, key TEXT NOT NULL, prompt TEXT, response TEXT NOT NULL, "
+                "created_at REAL, used_at REAL, PRIMARY KEY (backend, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                "key TEXT PRIMARY KEY, file_id TEXT NOT NULL, kind TEXT, created_at REAL, used_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_state ("
+                "user_id INTEGER PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        self._conn = conn
+        self._migrate_legacy_json()
+        self.users = {row[0] for row in conn.execute("SELECT id FROM users")}
+        self.groups = {row[0] for row in conn.execute("SELECT id FROM groups")}
+        self.health = {
+            row[0]: {
+                "consecutive_failures": row[1], "last_error": row[2], "last_error_at": row[3],
+                "last_success_at": row[4], "migrated_to": row[5], "dead": bool(row[6]),
+            }
+            for row in conn.execute(
+                "SELECT chat_id, consecutive_failures, last_error, last_error_at, last_success_at, "
+                "migrated_to, dead FROM chat_health"
+            )
+        }
+        logger.info("Store opened: %s users, %s groups", len(self.users), len(self.groups))
+
+    def _migrate_legacy_json(self):
+        conn = self._conn
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+        now = time.time()
+        users = [(int(uid), now) for uid in read_json(LEGACY_USERS_FILE, [])]
+        groups = [(int(gid), now) for gid in read_json(LEGACY_GROUPS_FILE, [])]
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO users (id, added_at) VALUES (?, ?)", users)
+            conn.executemany("INSERT OR IGNORE INTO groups (id, added_at) VALUES (?, ?)", groups)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (str(now),))
+        logger.info("Migrated %s users and %s groups from JSON", len(users), len(groups))
+
+    async def close(self):
+        if self._conn is not None:
+            await self.run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    async def add_user(self, user_id: int) -> bool:
+        if user_id in self.users:
+            return False
+        self.users.add(user_id)
+        await self.execute("INSERT OR IGNORE INTO users (id, added_at) VALUES (?, ?)", (user_id, time.time()))
+        return True
+
+    async def add_group(self, chat_id: int) -> bool:
+        if chat_id in self.groups:
+            return False
+        self.groups.add(chat_id)
+        await self.execute("INSERT OR IGNORE INTO groups (id, added_at) VALUES (?, ?)", (chat_id, time.time()))
+        return True
+
+    async def remove_group(self, chat_id: int) -> bool:
+        if chat_id not in self.groups:
+            return False
+        self.groups.discard(chat_id)
+        await self.execute("DELETE FROM groups WHERE id = ?", (chat_id,))
+        return True
+
+    def group_ids(self) -> list:
+        return list(self.groups)
+
+    async def get_file_id(self, key: str, max_age: float = None):
+        rows = await self.fetchall("SELECT file_id, created_at FROM file_ids WHERE key = ?", (key,))
+        if not rows:
+            return None
+        file_id, created_at = rows[0]
+        if max_age is not None and time.time() - (created_at or 0) > max_age:
+            await self.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+            return None
+        await self.execute("UPDATE file_ids SET used_at = ? WHERE key = ?", (time.time(), key))
+        return file_id
+
+    async def delete_file_id(self, key: str):
+        await self.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+
+    async def prune_file_ids(self, prefix: str, max_rows: int):
+        # Least recently used entries beyond max_rows are evicted.
+        await self.execute(
+            "DELETE FROM file_ids WHERE key IN ("
+            "SELECT key FROM file_ids WHERE key LIKE ? ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (prefix + "%", max_rows),
+        )
+
+    async def put_file_id(self, key: str, file_id: str, kind: str = None):
+        now = time.time()
+        await self.execute(
+            "INSERT OR REPLACE INTO file_ids (key, file_id, kind, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+            (key, file_id, kind, now, now),
+        )
+
+store = Store(DB_FILE)
+
 BOT_TOKEN = read_file(BOT_TOKEN_FILE)
 
 start_time = time.time()
@@ -110,100 +501,1727 @@ def get_uptime() -> str:
 def is_owner(user_id: int) -> bool:
     return user_id == OWNER_ID
 
-# ================= Forward Helper =================
+# ================= Metrics (Prometheus text format) =================
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS = []
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        METRICS.append(self)
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def collect(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn, labels=()):
+        # With labels, fn returns {label_values_tuple: value}.
+        self.name = name
+        self.doc = doc
+        self.fn = fn
+        self.labels = tuple(labels)
+        METRICS.append(self)
+
+    def collect(self):
+        if not self.labels:
+            yield f"{self.name} {self.fn()}"
+            return
+        for labels, value in self.fn().items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        METRICS.append(self)
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += 1
+        series[2] += value
+
+    def collect(self):
+        names = self.labels + ("le",)
+        for labels, (counts, total, value_sum) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(names, labels + ('+Inf',))} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {value_sum}"
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.doc}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+HANDLER_LATENCY = Histogram("hinata_handler_seconds", "Update handler latency", ("handler",))
+HANDLER_CALLS = Counter("hinata_handler_calls_total", "Update handler invocations", ("handler", "result"))
+BACKEND_LATENCY = Histogram("hinata_backend_seconds", "Outbound backend HTTP latency", ("backend",))
+BACKEND_CALLS = Counter("hinata_backend_calls_total", "Outbound backend HTTP calls", ("backend", "result"))
+TELEGRAM_LATENCY = Histogram("hinata_telegram_seconds", "Telegram Bot API request latency", ("method",))
+TELEGRAM_CALLS = Counter("hinata_telegram_calls_total", "Telegram Bot API requests", ("method", "result"))
+BROADCAST_MESSAGES = Counter("hinata_broadcast_messages_total", "Broadcast deliveries", ("result",))
+Gauge("hinata_uptime_seconds", "Seconds since the bot started", lambda: round(time.time() - start_time, 3))
+Gauge("hinata_log_dropped_total", "Log records dropped because the log queue was full", lambda: DroppingQueueHandler.dropped)
+
+# ================= Interaction Journal (batched JSONL) =================
+class Journal:
+    """Append-only JSONL journal. record() only buffers; a background task
+    writes batches off the event loop every JOURNAL_FLUSH_RECORDS records or
+    JOURNAL_FLUSH_MS milliseconds, sealing and gzipping full segments and
+    compacting the oldest segments into hourly aggregates."""
+
+    def __init__(self, path: str, flush_records: int, flush_ms: int):
+        self.path = path
+        self.flush_records = flush_records
+        self.flush_interval = flush_ms / 1000
+        self._buffer = []
+        self._wake = None
+        self._task = None
+        self._write_lock = None
+        self._stopping = False
+
+    def record(self, kind: str, **fields):
+        if not JOURNAL_ENABLED:
+            return
+        ctx = update_context.get() or {}
+        entry = {
+            "ts": round(time.time(), 3),
+            "kind": kind,
+            "user": ctx.get("user_id"),
+            "chat": ctx.get("chat_id"),
+            "handler": ctx.get("handler"),
+        }
+        entry.update(fields)
+        self._buffer.append(entry)
+        if len(self._buffer) >= self.flush_records and self._wake is not None:
+            self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._write_lock = asyncio.Lock()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Signal instead of cancelling: on 3.11 wait_for() swallows a cancel
+        # that lands in the same tick as the event firing, and _run never exits.
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Journal flush failed")
+        await self.flush()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        data = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in batch)
+        if self._write_lock is None:
+            self._write(data)
+            return
+        async with self._write_lock:
+            await asyncio.to_thread(self._write, data)
+
+    def _write(self, data: str):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+            size = f.tell()
+        if size >= JOURNAL_SEGMENT_BYTES:
+            self._seal()
+
+    def segment_pattern(self) -> str:
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}.*{ext}.gz"
+
+    def rollup_path(self) -> str:
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}-hourly{ext}.gz"
+
+    def _seal(self):
+        stem, ext = os.path.splitext(self.path)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        n = 0
+        sealed = f"{stem}.{stamp}-{n:03d}{ext}"
+        while os.path.exists(sealed + ".gz"):
+            n += 1
+            sealed = f"{stem}.{stamp}-{n:03d}{ext}"
+        os.replace(self.path, sealed)
+        _gzip_rotator(sealed, sealed + ".gz")
+        segments = sorted(glob.glob(self.segment_pattern()))
+        if len(segments) > JOURNAL_KEEP_SEGMENTS:
+            self._compact(segments[:-JOURNAL_KEEP_SEGMENTS])
+
+    def _compact(self, segments: list):
+        rollup = {}
+        for path in segments:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if not isinstance(record, dict) or "ts" not in record:
+                        continue
+                    hour = int(record["ts"] // 3600 * 3600)
+                    key = (hour, record.get("kind"), record.get("backend"), record.get("handler"))
+                    agg = rollup.get(key)
+                    if agg is None:
+                        agg = rollup[key] = {
+                            "ts": hour, "kind": key[1], "backend": key[2], "handler": key[3], "rollup": True,
+                            "count": 0, "errors": 0, "latency_sum": 0.0, "latency_n": 0, "latency_max": 0.0,
+                            "bytes": 0,
+                        }
+                    agg["count"] += 1
+                    if record.get("outcome") not in (None, "ok"):
+                        agg["errors"] += 1
+                    latency = record.get("latency_ms")
+                    if isinstance(latency, (int, float)):
+                        agg["latency_sum"] += latency
+                        agg["latency_n"] += 1
+                        agg["latency_max"] = max(agg["latency_max"], latency)
+                    if isinstance(record.get("size"), int):
+                        agg["bytes"] += record["size"]
+        # gzip members can be appended; readers see one continuous stream.
+        with gzip.open(self.rollup_path(), "at", encoding="utf-8") as f:
+            for agg in sorted(rollup.values(), key=lambda a: a["ts"]):
+                agg["latency_sum"] = round(agg["latency_sum"], 1)
+                f.write(json.dumps(agg, ensure_ascii=False, separators=(",", ":")) + "\n")
+        for path in segments:
+            os.remove(path)
+        logger.info("Compacted %s journal segments into %s hourly rows", len(segments), len(rollup))
+
+journal = Journal(JOURNAL_FILE, JOURNAL_FLUSH_RECORDS, JOURNAL_FLUSH_MS)
+
+def instrumented(callback):
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        chat = getattr(update, "effective_chat", None)
+        user = getattr(update, "effective_user", None)
+        token = update_context.set({
+            "handler": name,
+            "chat_id": chat.id if chat else None,
+            "user_id": user.id if user else None,
+        })
+        started = time.monotonic()
+        result = "ok"
+        try:
+            return await callback(update, context)
+        except Exception:
+            result = "error"
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            HANDLER_LATENCY.observe(elapsed, name)
+            HANDLER_CALLS.inc(name, result)
+            logger.log(
+                logging.INFO if elapsed >= SLOW_HANDLER_SECONDS else logging.DEBUG,
+                "%s %s in %.0f ms", name, result, elapsed * 1000,
+                extra={"latency_ms": round(elapsed * 1000, 1)},
+            )
+            journal.record("update", latency_ms=round(elapsed * 1000, 1), outcome=result)
+            update_context.reset(token)
+
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """Bot API transport that records per-method latency and failures."""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = "file_download" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+        started = time.monotonic()
+        try:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+        except Exception:
+            TELEGRAM_CALLS.inc(api_method, "exception")
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.monotonic() - started, api_method)
+        TELEGRAM_CALLS.inc(api_method, "ok" if code < 400 else str(code))
+        return code, payload
+
+# ================= Status HTTP server =================
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}
+MAX_HTTP_BODY = 1024 * 1024
+
+class StatusServer:
+    """Tiny asyncio HTTP/1.1 server for health checks and metrics on Render's web port."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self._server = None
+
+    def route(self, method: str, path: str, handler):
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Status server listening on %s:%s", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        status, content_type, body = 400, "text/plain", b"bad request"
+        head_only = False
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+            if length > MAX_HTTP_BODY:
+                status, body = 413, b"payload too large"
+            else:
+                payload = await reader.readexactly(length) if length else b""
+                path = target.split("?", 1)[0]
+                head_only = method == "HEAD"
+                handler = self.routes.get(("GET" if head_only else method, path))
+                if handler is not None:
+                    status, content_type, body = await handler(headers, payload)
+                elif any(p == path for _, p in self.routes):
+                    status, body = 405, b"method not allowed"
+                else:
+                    status, body = 404, b"not found"
+        except Exception as e:
+            logger.debug("Status server request failed: %s", e)
+        try:
+            writer.write(
+                f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'Error')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1")
+                + (b"" if head_only else body)
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+async def healthz_route(headers, body):
+    payload = {"status": "ok", "uptime": get_uptime()}
+    return 200, "application/json", json.dumps(payload).encode()
+
+async def metrics_route(headers, body):
+    return 200, "text/plain; version=0.0.4; charset=utf-8", render_metrics().encode()
+
+status_server = StatusServer(STATUS_HOST, STATUS_PORT)
+status_server.route("GET", "/healthz", healthz_route)
+status_server.route("GET", "/metrics", metrics_route)
+
+# ================= Keyword Matcher (Aho-Corasick) =================
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).casefold()
+
+class KeywordMatcher:
+    """Multi-pattern substring matcher; finds every keyword in one pass over
+    the NFKC-normalized, casefolded text."""
+
+    def __init__(self, keywords):
+        self.keywords = [k for k in dict.fromkeys(keywords) if normalize_text(k)]
+        goto = [{}]
+        outputs = [set()]
+        for index, keyword in enumerate(self.keywords):
+            node = 0
+            for ch in normalize_text(keyword):
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    goto.append({})
+                    outputs.append(set())
+                    nxt = len(goto) - 1
+                    goto[node][ch] = nxt
+                node = nxt
+            outputs[node].add(index)
+
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            for ch, child in goto[node].items():
+                queue.append(child)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fallback = goto[f].get(ch, 0)
+                fail[child] = fallback if fallback != child else 0
+                outputs[child] |= outputs[fail[child]]
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = [tuple(sorted(o)) for o in outputs]
+
+    def find(self, text: str) -> list:
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        found = set()
+        node = 0
+        for ch in normalize_text(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if outputs[node]:
+                found.update(outputs[node])
+        return [self.keywords[i] for i in sorted(found)]
+
+class KeywordWatcher:
+    def __init__(self, defaults, path: str):
+        self.defaults = defaults
+        self.path = path
+        self._mtime = None
+        self._checked = 0.0
+        self.matcher = KeywordMatcher(defaults)
+
+    def reload(self, force: bool = False) -> bool:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if not force and mtime == self._mtime:
+            return False
+        keywords = read_json(self.path, None) if mtime is not None else None
+        if keywords is not None and not isinstance(keywords, list):
+            logger.warning("Ignoring %s: expected a JSON list of keywords", self.path)
+            keywords = None
+        self.matcher = KeywordMatcher([str(k) for k in keywords] if keywords is not None else self.defaults)
+        self._mtime = mtime
+        logger.info("Loaded %s keywords", len(self.matcher.keywords))
+        return True
+
+    def get(self) -> KeywordMatcher:
+        now = time.monotonic()
+        if now - self._checked >= KEYWORDS_RELOAD_CHECK:
+            self._checked = now
+            self.reload()
+        return self.matcher
+
+keyword_watcher = KeywordWatcher(KEYWORDS, KEYWORDS_FILE)
+
+# ================= Forward Helper (background inbox pipeline) =================
+INBOX_DROPPED = Counter("hinata_inbox_dropped_total", "Inbox forwards dropped because the queue was full")
+
+class InboxForwarder:
+    """Audit forwarding to INBOX_FORWARD_GROUP_ID, done by a background worker
+    so handlers never wait on it. The queue is bounded and drops the oldest
+    item when full; bursts are coalesced into one digest caption, and only
+    items the digest can't show in full (media, long texts) are forwarded."""
+
+    def __init__(self, chat_id: int, maxsize: int):
+        self.chat_id = chat_id
+        self.queue = asyncio.Queue(maxsize)
+        self.bot = None
+        self._task = None
+
+    def submit(self, item: dict):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except asyncio.QueueFull:
+                try:
+                    self.queue.get_nowait()
+                    INBOX_DROPPED.inc()
+                except asyncio.QueueEmpty:
+                    pass
+
+    def start(self, bot):
+        self.bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        send_priority.set(PRIORITY_FORWARD)
+        while True:
+            batch = [await self.queue.get()]
+            if INBOX_DIGEST_ENABLED:
+                while len(batch) < INBOX_DIGEST_MAX and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+            try:
+                if INBOX_DIGEST_ENABLED and len(batch) >= INBOX_DIGEST_THRESHOLD:
+                    await self._send_digest(batch)
+                else:
+                    for item in batch:
+                        await self._send_one(item)
+            except Exception:
+                logger.exception("Inbox forwarding failed")
+
+    async def _forward(self, item: dict):
+        if item["message_id"] is None:
+            return
+        try:
+            await self.bot.forward_message(
+                chat_id=self.chat_id, from_chat_id=item["from_chat_id"], message_id=item["message_id"]
+            )
+        except Exception as e:
+            logger.warning(f"Failed to forward: {e}")
+            try:
+                await self.bot.send_message(chat_id=self.chat_id, text=item["fallback"], parse_mode="HTML")
+            except Exception as e2:
+                logger.warning(f"Failed fallback forward: {e2}")
+
+    async def _send_one(self, item: dict):
+        try:
+            await self.bot.send_message(chat_id=self.chat_id, text=item["caption"], parse_mode="HTML")
+        except Exception as e:
+            logger.warning(f"Failed to send inbox caption: {e}")
+        await self._forward(item)
+
+    async def _send_digest(self, batch: list):
+        header = f"📬 <b>Inbox digest</b> ({len(batch)} items)"
+        parts = [header]
+        size = len(header)
+        shown = 0
+        for item in batch:
+            entry = item.get("digest", item["caption"])
+            size += len(entry) + 2
+            if size > 4000:
+                parts.append("…")
+                break
+            parts.append(entry)
+            shown += 1
+        try:
+            await self.bot.send_message(chat_id=self.chat_id, text="\n\n".join(parts), parse_mode="HTML")
+        except Exception as e:
+            logger.warning(f"Failed to send inbox digest, sending items one by one: {e}")
+            for item in batch:
+                await self._send_one(item)
+            return
+        # The digest stands in for short text items; the rest still need the original message.
+        for item in batch[:shown]:
+            if item.get("forward", True):
+                await self._forward(item)
+        for item in batch[shown:]:
+            await self._send_one(item)
+
+inbox = InboxForwarder(INBOX_FORWARD_GROUP_ID, INBOX_QUEUE_SIZE)
+Gauge("hinata_inbox_queue_depth", "Inbox forwards waiting to be sent", lambda: inbox.queue.qsize())
+
 async def forward_or_copy(update: Update, context: ContextTypes.DEFAULT_TYPE, command_text: str = None):
     user = update.effective_user
     msg_type = "Command" if command_text else "Message"
+    sender = f"📨 From: {html.escape(user.full_name)} (@{html.escape(str(user.username))})"
+    caption = f"{sender}\nID: <code>{user.id}</code>\nType: {msg_type}"
+    digest = caption
+    forward = True
+    if command_text:
+        caption += f"\nCommand: {html.escape(command_text)}"
+        digest += f"\nCommand: {html.escape(command_text[:INBOX_DIGEST_EXCERPT])}"
+        forward = len(command_text) > INBOX_DIGEST_EXCERPT
+    elif update.message and update.message.text:
+        caption += f"\nMessage: {html.escape(update.message.text)}"
+        digest += f"\nMessage: {html.escape(update.message.text[:INBOX_DIGEST_EXCERPT])}"
+        forward = len(update.message.text) > INBOX_DIGEST_EXCERPT
+    if forward and digest != caption:
+        digest += "…"
+    text = (update.message.text if update.message else None) or "<Media/Sticker/Other>"
+    inbox.submit({
+        "caption": caption,
+        "digest": digest,
+        "forward": forward,
+        "fallback": f"{sender}\nID: <code>{user.id}</code>\nType: {msg_type}\nContent: {html.escape(text)}",
+        "from_chat_id": update.effective_chat.id if update.effective_chat else None,
+        "message_id": update.message.message_id if update.message else None,
+    })
+
+# ================= Forwarding Router =================
+class Router:
+    def __init__(self):
+        self.users = {}
+        self.chats = {}
+
+    @staticmethod
+    def _parse(table) -> dict:
+        parsed = {}
+        for key, destinations in (table or {}).items():
+            if isinstance(destinations, (int, str)):
+                destinations = [destinations]
+            parsed[int(key)] = tuple(dict.fromkeys(int(d) for d in destinations))
+        return parsed
+
+    def load(self, path: str = ROUTES_FILE):
+        routes = read_json(path, DEFAULT_ROUTES) if os.path.exists(path) else DEFAULT_ROUTES
+        if not isinstance(routes, dict):
+            logger.warning("Ignoring %s: expected an object with users/chats", path)
+            routes = DEFAULT_ROUTES
+        try:
+            users, chats = self._parse(routes.get("users")), self._parse(routes.get("chats"))
+        except (TypeError, ValueError):
+            logger.exception("Invalid routing table in %s", path)
+            return
+        self.users, self.chats = users, chats
+        logger.info("Loaded routes: %s tracked users, %s mirrored chats", len(self.users), len(self.chats))
+
+router = Router()
+router.load()
+
+async def _copy_fallback(bot, msg, destination: int):
     try:
-        caption = f"📨 From: {user.full_name} (@{user.username})\nID: <code>{user.id}</code>\nType: {msg_type}"
-        if command_text:
-            caption += f"\nCommand: {command_text}"
-        elif update.message and update.message.text:
-            caption += f"\nMessage: {update.message.text}"
-
-        await context.bot.send_message(chat_id=INBOX_FORWARD_GROUP_ID, text=caption, parse_mode="HTML")
-        if update.message:
-            await update.message.forward(chat_id=INBOX_FORWARD_GROUP_ID)
-    except Exception as e:
-        logger.warning(f"Failed to forward: {e}")
+        await bot.copy_message(chat_id=destination, from_chat_id=msg.chat.id, message_id=msg.message_id)
+    except Exception:
+        if msg.text:
+            copy_text = f"📨 From: {msg.from_user.full_name} (@{msg.from_user.username})\nContent: {msg.text}"
+            await bot.send_message(chat_id=destination, text=copy_text)
+
+async def deliver_tracked(bot, msg, destination: int):
+    try:
+        await bot.send_message(chat_id=destination,
+                               text=f"📨 Message from tracked user in <b>{msg.chat.title}</b>",
+                               parse_mode="HTML")
         try:
-            if update.message:
-                text = update.message.text or "<Media/Sticker/Other>"
-                safe_text = f"📨 From: {user.full_name} (@{user.username})\nID: <code>{user.id}</code>\nType: {msg_type}\nContent: {text}"
-                await context.bot.send_message(chat_id=INBOX_FORWARD_GROUP_ID, text=safe_text, parse_mode="HTML")
-        except Exception as e2:
-            logger.warning(f"Failed fallback forward: {e2}")
+            await msg.forward(chat_id=destination)
+        except Exception:
+            await _copy_fallback(bot, msg, destination)
+    except Exception:
+        logger.exception("Tracked forward to %s failed", destination)
 
-# ================= HTTP Helpers using httpx =================
-async def fetch_json(client: httpx.AsyncClient, url: str):
+async def deliver_mirror(bot, msg, destination: int):
     try:
-        resp = await client.get(url, timeout=30.0)
-        text = resp.text
         try:
-            return json.loads(text)
+            await msg.forward(chat_id=destination)
+        except Exception:
+            await _copy_fallback(bot, msg, destination)
+    except Exception:
+        logger.exception("Mirror to %s failed", destination)
+
+async def route_message(bot, msg):
+    sends = [deliver_tracked(bot, msg, d) for d in router.users.get(msg.from_user.id, ())]
+    sends += [deliver_mirror(bot, msg, d) for d in router.chats.get(msg.chat.id, ())]
+    if sends:
+        with outbound_priority(PRIORITY_FORWARD):
+            await asyncio.gather(*sends)
+
+# ================= Shared HTTP clients =================
+_http_clients = {}
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("HTTP2_ENABLED is set but the h2 package is missing; using HTTP/1.1")
+        return False
+
+def http_client(backend: str) -> httpx.AsyncClient:
+    client = _http_clients.get(backend)
+    if client is None or client.is_closed:
+        read_timeout = BACKEND_TIMEOUTS.get(backend, DEFAULT_BACKEND_TIMEOUT)
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=min(HTTP_CONNECT_TIMEOUT, read_timeout)),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            http2=_http2_available(),
+            follow_redirects=True,
+        )
+        _http_clients[backend] = client
+    return client
+
+def open_http_clients():
+    for backend in BACKEND_TIMEOUTS:
+        http_client(backend)
+
+async def close_http_clients():
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
         except Exception:
-            return {"raw": text}
+            logger.exception("Failed to close HTTP client")
+
+# ================= Backend health (circuit breakers + latency) =================
+class CircuitBreaker:
+    def __init__(self, name: str, threshold: int, reset_timeout: float):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open":
+            # One trial request at a time; a trial that never reported back
+            # (e.g. cancelled by a race) expires after reset_timeout.
+            now = time.monotonic()
+            if self._trial_started is None or now - self._trial_started >= self.reset_timeout:
+                self._trial_started = now
+                return True
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Circuit for %s closed", self.name)
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_started = None
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning("Circuit for %s opened after %s failures", self.name, self.failures)
+            self.opened_at = time.monotonic()
+
+class LatencyTracker:
+    def __init__(self, window: int):
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float):
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def __len__(self):
+        return len(self._samples)
+
+breakers = {
+    name: CircuitBreaker(name, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT) for name in BACKEND_TIMEOUTS
+}
+backend_latency = {name: LatencyTracker(LATENCY_WINDOW) for name in BACKEND_TIMEOUTS}
+
+def _record_backend_result(backend, ok: bool, elapsed: float):
+    if backend is None:
+        return
+    BACKEND_LATENCY.observe(elapsed, backend)
+    BACKEND_CALLS.inc(backend, "ok" if ok else "error")
+    if ok:
+        breakers[backend].record_success()
+        backend_latency[backend].observe(elapsed)
+    else:
+        breakers[backend].record_failure()
+
+# ================= HTTP Helpers using httpx =================
+async def fetch_json(client: httpx.AsyncClient, url: str, backend: str = None):
+    if backend is not None and not breakers[backend].allow():
+        return {"error": f"{backend} temporarily unavailable (circuit open)"}
+    started = time.monotonic()
+    try:
+        resp = await client.get(url)
+        text = resp.text
+        if resp.status_code >= 500:
+            # Sleeping Render apps / failing Vercel functions answer with an HTML error page.
+            data = {"error": f"HTTP {resp.status_code} from {backend or 'backend'}", "raw": text[:500]}
+        else:
+            try:
+                data = json.loads(text)
+            except Exception:
+                data = {"error": f"Non-JSON response (HTTP {resp.status_code})", "raw": text[:500]}
+        _record_backend_result(backend, not (isinstance(data, dict) and "error" in data), time.monotonic() - started)
+        return data
     except Exception as e:
         logger.exception("HTTP GET failed for %s", url)
+        _record_backend_result(backend, False, time.monotonic() - started)
         return {"error": str(e)}
 
-async def fetch_text(client: httpx.AsyncClient, url: str):
-    try:
-        resp = await client.get(url, timeout=30.0)
-        return resp.text
-    except Exception as e:
-        logger.exception("HTTP GET failed for %s", url)
-        return f"Error: {e}"
+async def fetch_text(client: httpx.AsyncClient, url: str, backend: str = None):
+    if backend is not None and not breakers[backend].allow():
+        return f"Error: {backend} temporarily unavailable (circuit open)"
+    started = time.monotonic()
+    try:
+        resp = await client.get(url)
+        _record_backend_result(backend, resp.status_code < 500, time.monotonic() - started)
+        if resp.status_code >= 500:
+            return f"Error: HTTP {resp.status_code} from {backend or 'backend'}"
+        return resp.text
+    except Exception as e:
+        logger.exception("HTTP GET failed for %s", url)
+        _record_backend_result(backend, False, time.monotonic() - started)
+        return f"Error: {e}"
+
+# ================= Lookup Cache (TTL + LRU + single-flight) =================
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is not None:
+            expires, value = item
+            if expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight coroutine."""
+
+    def __init__(self):
+        self._inflight = {}
+        self.coalesced = 0
+
+    async def do(self, key, factory):
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return await asyncio.shield(fut)
+        fut = asyncio.ensure_future(factory())
+        self._inflight[key] = fut
+        try:
+            return await asyncio.shield(fut)
+        finally:
+            if fut.done():
+                self._inflight.pop(key, None)
+            else:
+                fut.add_done_callback(lambda _f: self._inflight.pop(key, None))
+
+lookup_caches = {
+    name: TTLCache(LOOKUP_CACHE_SIZE, ttl) for name, ttl in LOOKUP_CACHE_TTL.items()
+}
+lookup_flights = {name: SingleFlight() for name in LOOKUP_CACHE_TTL}
+
+def normalize_insta_username(username: str) -> str:
+    return username.strip().lstrip("@").lower()
+
+def normalize_ff_uid(uid: str) -> str:
+    return uid.strip()
+
+async def cached_lookup(backend: str, key: str, url: str, is_ok):
+    started = time.monotonic()
+    cache = lookup_caches[backend]
+
+    async def load():
+        result = await fetch_json(http_client(backend), url, backend=backend)
+        if is_ok(result):
+            cache.set(key, result)
+        return result
+
+    data = cache.get(key)
+    source = "cache"
+    if data is None:
+        source = "upstream"
+        data = await lookup_flights[backend].do(key, load)
+    journal.record(
+        "lookup", backend=backend, key=key, source=source,
+        latency_ms=round((time.monotonic() - started) * 1000, 1),
+        size=len(json.dumps(data, ensure_ascii=False)),
+        outcome="ok" if is_ok(data) else "error",
+    )
+    return data
+
+def insta_ok(data) -> bool:
+    return isinstance(data, dict) and data.get("status") == "ok"
+
+def ff_ok(data) -> bool:
+    return isinstance(data, dict) and "error" not in data and "raw" not in data
+
+async def fetch_insta_profile(username: str):
+    key = normalize_insta_username(username)
+    return await cached_lookup("insta", key, INSTA_API.format(key), insta_ok)
+
+async def fetch_ff_player(uid: str):
+    key = normalize_ff_uid(uid)
+    return await cached_lookup("ff", key, FF_API.format(key), ff_ok)
+
+async def fetch_chatgpt(client: httpx.AsyncClient, prompt: str):
+    url = CHATGPT_API_URL.format(prompt=prompt.replace(" ", "+"))
+    data = await fetch_json(client, url, backend="chatgpt")
+    if isinstance(data, dict):
+        if "error" in data:
+            return f"Error: {data['error']}"
+        return data.get("reply") or data.get("response") or data.get("answer") or json.dumps(data)
+    return str(data)
+
+async def fetch_gemini3(client: httpx.AsyncClient, prompt: str):
+    try:
+        url = GEMINI3_API.format(prompt.replace(" ", "+"))
+        data = await fetch_json(client, url, backend="gemini")
+        if isinstance(data, dict):
+            if "error" in data:
+                return f"Error: {data['error']}"
+            return data.get("response") or data.get("reply") or data.get("answer") or json.dumps(data)
+        return str(data)
+    except Exception as e:
+        logger.exception("Gemini3 fetch failed")
+        return f"Error: {e}"
+
+async def fetch_deepseek(client: httpx.AsyncClient, prompt: str):
+    try:
+        url = DEEPSEEK_API.format(prompt.replace(" ", "+"))
+        text = await fetch_text(client, url, backend="deepseek")
+        return text
+    except Exception as e:
+        logger.exception("DeepSeek fetch failed")
+        return f"Error: {e}"
+
+# ================= AI dispatch (hedging, race, stream) =================
+AI_BACKENDS = {
+    "chatgpt": ("ChatGPT", fetch_chatgpt),
+    "gemini": ("Gemini 3", fetch_gemini3),
+    "deepseek": ("DeepSeek 3.2", fetch_deepseek),
+}
+
+def is_error_reply(reply) -> bool:
+    return not reply or str(reply).startswith("Error:")
+
+def hedge_delay(backend: str):
+    tracker = backend_latency[backend]
+    if len(tracker) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY, tracker.percentile(95))
+
+async def _first_good(tasks):
+    # Returns the first non-error result (or the last error) and cancels the rest.
+    pending = set(tasks)
+    reply = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                reply = task.result()
+                if not is_error_reply(reply):
+                    return reply
+        return reply
+    finally:
+        for task in pending:
+            task.cancel()
+
+class PromptCache:
+    """Persistent AI answer cache (prompt_cache table), keyed by backend and
+    the whitespace/case-folded prompt, with per-backend TTL and LRU limit."""
+
+    def __init__(self):
+        self.hits = {}
+        self.misses = {}
+
+    @staticmethod
+    def normalize(prompt: str) -> str:
+        return " ".join(normalize_text(prompt).split())
+
+    def key(self, prompt: str) -> str:
+        return hashlib.sha256(self.normalize(prompt).encode()).hexdigest()
+
+    async def get(self, backend: str, prompt: str):
+        if not PROMPT_CACHE_ENABLED:
+            return None
+        key = self.key(prompt)
+        rows = await store.fetchall(
+            "SELECT response, created_at FROM prompt_cache WHERE backend = ? AND key = ?", (backend, key)
+        )
+        if rows and time.time() - (rows[0][1] or 0) <= PROMPT_CACHE_TTL.get(backend, 0):
+            self.hits[backend] = self.hits.get(backend, 0) + 1
+            await store.execute(
+                "UPDATE prompt_cache SET used_at = ? WHERE backend = ? AND key = ?", (time.time(), backend, key)
+            )
+            return rows[0][0]
+        self.misses[backend] = self.misses.get(backend, 0) + 1
+        return None
+
+    async def put(self, backend: str, prompt: str, response: str):
+        if not PROMPT_CACHE_ENABLED:
+            return
+        now = time.time()
+        await store.execute(
+            "INSERT OR REPLACE INTO prompt_cache (backend, key, prompt, response, created_at, used_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (backend, self.key(prompt), self.normalize(prompt)[:200], response, now, now),
+        )
+        await store.execute(
+            "DELETE FROM prompt_cache WHERE backend = ? AND (created_at < ? OR key IN ("
+            "SELECT key FROM prompt_cache WHERE backend = ? ORDER BY used_at DESC LIMIT -1 OFFSET ?))",
+            (backend, now - PROMPT_CACHE_TTL.get(backend, 0), backend, PROMPT_CACHE_MAX.get(backend, 0)),
+        )
+
+    async def stats(self) -> list:
+        return await store.fetchall(
+            "SELECT backend, COUNT(*), COALESCE(SUM(LENGTH(response)), 0) FROM prompt_cache GROUP BY backend"
+        )
+
+    async def top(self, limit: int = 10) -> list:
+        return await store.fetchall(
+            "SELECT backend, prompt, used_at FROM prompt_cache ORDER BY used_at DESC LIMIT ?", (limit,)
+        )
+
+    async def purge(self, backend: str = None) -> int:
+        if backend:
+            return await store.execute("DELETE FROM prompt_cache WHERE backend = ?", (backend,))
+        return await store.execute("DELETE FROM prompt_cache")
+
+prompt_cache = PromptCache()
+
+# ================= AI admission control (fair queuing) =================
+class AdmissionRefused(Exception):
+    pass
+
+class UserRateLimiter:
+    """Non-blocking per-user token bucket."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+
+    def try_acquire(self, user_id) -> bool:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            return False
+        self._buckets[user_id] = (tokens - 1, now)
+        if len(self._buckets) > 10000:
+            full = now - self.burst / self.rate
+            self._buckets = {u: v for u, v in self._buckets.items() if v[1] > full}
+        return True
+
+class FairScheduler:
+    """Per-backend concurrency limit with round-robin service across users,
+    so one user's burst queues behind everyone else's next request."""
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self._queues = {}
+        self._order = deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _grant_next(self):
+        while self.active < self.limit and self._order:
+            user = self._order.popleft()
+            waiters = self._queues[user]
+            fut = waiters.popleft()
+            if waiters:
+                self._order.append(user)
+            else:
+                del self._queues[user]
+            if not fut.done():
+                self.active += 1
+                fut.set_result(None)
+
+    def _remove(self, user, fut):
+        waiters = self._queues.get(user)
+        if waiters and fut in waiters:
+            waiters.remove(fut)
+            if not waiters:
+                del self._queues[user]
+                self._order.remove(user)
+
+    def position(self, user, fut) -> int:
+        waiters = self._queues.get(user)
+        if not waiters or fut not in waiters:
+            return 0
+        k = waiters.index(fut)
+        order = list(self._order)
+        mine = order.index(user)
+        position = k + 1
+        for i, other in enumerate(order):
+            if other != user:
+                position += min(len(self._queues[other]), k + (1 if i < mine else 0))
+        return position
+
+    def try_acquire(self) -> bool:
+        # Non-blocking extra slot (used for hedges): only when nobody is waiting.
+        if self.active < self.limit and not self._order:
+            self.active += 1
+            return True
+        return False
+
+    def release(self):
+        self.active -= 1
+        self._grant_next()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user, on_queued=None):
+        if not self.try_acquire():
+            if self.waiting >= self.max_queue:
+                raise AdmissionRefused(f"{self.name} is overloaded, please try again shortly.")
+            fut = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(user, deque()).append(fut)
+            if user not in self._order:
+                self._order.append(user)
+            try:
+                await self._wait_turn(user, fut, on_queued)
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    self.release()
+                else:
+                    fut.cancel()
+                    self._remove(user, fut)
+                raise
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def _wait_turn(self, user, fut, on_queued):
+        shown = None
+        while not fut.done():
+            position = self.position(user, fut)
+            if on_queued is not None and position and position != shown:
+                shown = position
+                try:
+                    await on_queued(position)
+                except Exception as e:
+                    logger.debug("Queue notice failed: %s", e)
+            try:
+                await asyncio.wait_for(asyncio.shield(fut), timeout=AI_QUEUE_UPDATE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        # On 3.11 wait_for() returns the result instead of raising when a cancel
+        # lands in the same tick fut is granted; don't keep a slot for a cancelled caller.
+        task = asyncio.current_task()
+        if task is not None and task.cancelling():
+            raise asyncio.CancelledError
+
+ai_schedulers = {name: FairScheduler(name, AI_CONCURRENCY.get(name, 4), AI_MAX_QUEUE) for name in AI_BACKENDS}
+ai_user_limiter = UserRateLimiter(AI_USER_RATE, AI_USER_BURST)
+
+def queue_notice(msg, base_text: str, label: str = None):
+    where = f"the {label} queue" if label else "the queue"
+    async def notify(position: int):
+        await msg.edit_text(f"{base_text}\n🕒 You're #{position} in {where}")
+    return notify
+
+async def _ask_ai_admitted(backend: str, prompt: str, hedge: bool, on_queued) -> str:
+    ctx = update_context.get() or {}
+    user_id = ctx.get("user_id")
+    if user_id is not None and not is_owner(user_id) and not ai_user_limiter.try_acquire(user_id):
+        return "Error: You're sending requests too fast, please wait a few seconds."
+    try:
+        async with ai_schedulers[backend].slot(user_id, on_queued):
+            return await _ask_ai_hedged(backend, prompt, hedge)
+    except AdmissionRefused as e:
+        return f"Error: {e}"
+
+async def ask_ai(backend: str, prompt: str, hedge: bool = False, use_cache: bool = True, on_queued=None) -> str:
+    started = time.monotonic()
+    reply = await prompt_cache.get(backend, prompt) if use_cache else None
+    source = "cache"
+    if reply is None:
+        source = "upstream"
+        reply = await _ask_ai_admitted(backend, prompt, hedge, on_queued)
+        if not is_error_reply(reply):
+            await prompt_cache.put(backend, prompt, reply)
+    journal.record(
+        "ai", backend=backend, prompt_len=len(prompt), source=source,
+        latency_ms=round((time.monotonic() - started) * 1000, 1),
+        size=len(reply or ""), outcome="error" if is_error_reply(reply) else "ok",
+    )
+    return reply
+
+async def _ask_ai_hedged(backend: str, prompt: str, hedge: bool) -> str:
+    fetch = AI_BACKENDS[backend][1]
+    delay = hedge_delay(backend) if hedge else None
+    if delay is None or breakers[backend].state != "closed":
+        return await fetch(http_client(backend), prompt)
+    # Hedge: if the first request is slower than the backend's p95, fire a
+    # second one and take whichever good answer arrives first. The hedge needs
+    # its own scheduler slot, so it never pushes a backend past AI_CONCURRENCY.
+    first = asyncio.create_task(fetch(http_client(backend), prompt))
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+    except asyncio.CancelledError:
+        first.cancel()
+        raise
+    if done:
+        return first.result()
+    scheduler = ai_schedulers[backend]
+    if not scheduler.try_acquire():
+        logger.info("Not hedging %s request, no free slot", backend)
+        return await first
+    logger.info("Hedging %s request after %.1fs", backend, delay)
+    try:
+        second = asyncio.create_task(fetch(http_client(backend), prompt))
+        return await _first_good([first, second])
+    finally:
+        scheduler.release()
+
+# ================= Broadcast Helpers =================
+def update_stats(sent_users=0, failed_users=0, sent_groups=0, failed_groups=0):
+    stats = read_json("stats.json", {})
+    if not isinstance(stats, dict):
+        stats = {}
+    for key, value in (("sent_users", sent_users), ("failed_users", failed_users),
+                       ("sent_groups", sent_groups), ("failed_groups", failed_groups)):
+        stats[key] = stats.get(key, 0) + value
+    write_json("stats.json", stats)
+
+# ================= Chat Health (dead-chat detection) =================
+def classify_send_error(exc: Exception):
+    """Returns (error_type, fatal, counts) for a failed Telegram send.
+
+    Only chat-level and transport errors count towards CHAT_DEAD_THRESHOLD; a
+    BadRequest about the payload itself (too long, bad file id, bad entities)
+    says nothing about the chat and is only recorded."""
+    if isinstance(exc, Forbidden):
+        return "forbidden", True, True
+    if isinstance(exc, BadRequest):
+        text = str(exc).lower()
+        if "chat not found" in text or "group chat was deactivated" in text:
+            return "chat_not_found", True, True
+        if "not enough rights" in text or "have no rights" in text:
+            return "no_rights", False, True
+        return "bad_request", False, False
+    return type(exc).__name__, False, True
+
+class ChatHealth:
+    """Per-chat delivery health kept in memory and persisted to chat_health."""
+
+    def is_dead(self, chat_id: int) -> bool:
+        record = store.health.get(chat_id)
+        return bool(record and record["dead"])
+
+    async def _save(self, chat_id: int, record: dict):
+        store.health[chat_id] = record
+        await store.execute(
+            "INSERT OR REPLACE INTO chat_health (chat_id, consecutive_failures, last_error, last_error_at, "
+            "last_success_at, migrated_to, dead) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (chat_id, record["consecutive_failures"], record["last_error"], record["last_error_at"],
+             record["last_success_at"], record["migrated_to"], int(record["dead"])),
+        )
+
+    def _record(self, chat_id: int) -> dict:
+        return dict(store.health.get(chat_id) or {
+            "consecutive_failures": 0, "last_error": None, "last_error_at": None,
+            "last_success_at": None, "migrated_to": None, "dead": False,
+        })
+
+    async def success(self, chat_id: int):
+        record = self._record(chat_id)
+        now = time.time()
+        stale = now - (record["last_success_at"] or 0) >= CHAT_HEALTH_SUCCESS_WRITE
+        if record["consecutive_failures"] or record["dead"] or stale:
+            revived = record["dead"] and not record["migrated_to"]
+            record.update(consecutive_failures=0, last_success_at=now, dead=False)
+            await self._save(chat_id, record)
+            if revived and chat_id < 0:
+                # A forced send reached a pruned group: track it again, as track_group would.
+                await store.add_group(chat_id)
+
+    async def failure(self, chat_id: int, error_type: str, fatal: bool = False, counts: bool = True):
+        record = self._record(chat_id)
+        if counts:
+            record["consecutive_failures"] += 1
+        record["last_error"] = error_type
+        record["last_error_at"] = time.time()
+        if fatal or (counts and record["consecutive_failures"] >= CHAT_DEAD_THRESHOLD):
+            if not record["dead"]:
+                logger.info("Chat %s marked dead (%s)", chat_id, error_type)
+            record["dead"] = True
+            if DEAD_CHAT_POLICY == "prune":
+                await store.remove_group(chat_id)
+        await self._save(chat_id, record)
+
+    async def migrated(self, chat_id: int, new_chat_id: int):
+        record = self._record(chat_id)
+        record.update(last_error="migrated", last_error_at=time.time(), migrated_to=new_chat_id, dead=True)
+        await self._save(chat_id, record)
+        if chat_id in store.groups:
+            await store.remove_group(chat_id)
+            await store.add_group(new_chat_id)
+        logger.info("Chat %s migrated to %s", chat_id, new_chat_id)
+
+    async def reset(self, chat_id: int):
+        if chat_id in store.health:
+            record = self._record(chat_id)
+            record.update(consecutive_failures=0, dead=False)
+            await self._save(chat_id, record)
+
+    def live_groups(self) -> list:
+        return [gid for gid in store.group_ids() if not self.is_dead(gid)]
+
+chat_health = ChatHealth()
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class PerChatLimiter:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_slot = {}
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(chat_id, 0.0))
+        self._next_slot[chat_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+broadcast_bucket = TokenBucket(BROADCAST_GLOBAL_RATE, BROADCAST_BURST)
+broadcast_chat_limiter = PerChatLimiter(BROADCAST_PER_CHAT_INTERVAL)
+_broadcast_tasks = {}
+_broadcasts_stopping = False
+
+def _retry_seconds(exc: RetryAfter) -> float:
+    retry_after = exc.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        retry_after = retry_after.total_seconds()
+    return float(retry_after)
+
+MEDIA_KINDS = ("photo", "video", "document", "album")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".m4v", ".webm", ".mkv")
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+INPUT_MEDIA = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument}
+
+def guess_media_type(url: str) -> str:
+    path = url.split("?", 1)[0].lower()
+    if path.endswith(VIDEO_EXTENSIONS):
+        return "video"
+    if path.endswith(PHOTO_EXTENSIONS) or "." not in path.rsplit("/", 1)[-1]:
+        return "photo"
+    return "document"
+
+def media_cache_key(item: dict) -> str:
+    return f"url:{item['type']}:{item['url']}"
+
+def message_file_id(message):
+    attachment = message.effective_attachment if message else None
+    if isinstance(attachment, (list, tuple)):
+        attachment = attachment[-1] if attachment else None
+    return getattr(attachment, "file_id", None)
+
+async def remember_file_id(item: dict, message):
+    # First successful send: reuse Telegram's file_id for the rest of the
+    # fan-out and remember it for future broadcasts of the same URL.
+    if item.get("file_id"):
+        return
+    file_id = message_file_id(message)
+    if not file_id:
+        return
+    item["file_id"] = file_id
+    if item.get("url"):
+        await store.put_file_id(media_cache_key(item), file_id, item["type"])
+
+async def resolve_cached_media(items: list):
+    for item in items:
+        if not item.get("file_id") and item.get("url"):
+            item["file_id"] = await store.get_file_id(media_cache_key(item))
+
+def media_needs_upload(job: dict) -> bool:
+    return job["kind"] in MEDIA_KINDS and any(not item.get("file_id") for item in job["media"])
+
+async def deliver_broadcast_payload(bot, job: dict, chat_id: int):
+    kind = job["kind"]
+    if kind not in MEDIA_KINDS:
+        await bot.send_message(chat_id=chat_id, text=job["text"])
+        return
+    caption = job.get("caption") or None
+    items = job["media"]
+    if kind == "album":
+        media = [
+            INPUT_MEDIA[item["type"]](media=item.get("file_id") or item["url"], caption=caption if i == 0 else None)
+            for i, item in enumerate(items)
+        ]
+        messages = await bot.send_media_group(chat_id=chat_id, media=media)
+        for item, message in zip(items, messages):
+            await remember_file_id(item, message)
+        return
+    item = items[0]
+    sender = getattr(bot, f"send_{kind}")
+    message = await sender(chat_id=chat_id, caption=caption, **{kind: item.get("file_id") or item["url"]})
+    await remember_file_id(item, message)
+
+async def send_broadcast_item(bot, job: dict, chat_id: int, force: bool = False) -> bool:
+    # force: an explicit single-chat send from the owner, tried even if the chat is marked dead.
+    if not force and chat_health.is_dead(chat_id):
+        BROADCAST_MESSAGES.inc("skipped_dead")
+        return False
+    for attempt in range(BROADCAST_MAX_RETRIES + 1):
+        await broadcast_chat_limiter.wait(chat_id)
+        await broadcast_bucket.acquire()
+        try:
+            await deliver_broadcast_payload(bot, job, chat_id)
+            BROADCAST_MESSAGES.inc("sent")
+            await chat_health.success(chat_id)
+            return True
+        except ChatMigrated as e:
+            await chat_health.migrated(chat_id, e.new_chat_id)
+            chat_id = e.new_chat_id
+        except RetryAfter as e:
+            BROADCAST_MESSAGES.inc("retry_after")
+            logger.warning("Broadcast to %s hit flood control, retrying in %ss", chat_id, e.retry_after)
+            await asyncio.sleep(_retry_seconds(e) + 0.5)
+        except TimedOut:
+            BROADCAST_MESSAGES.inc("timeout")
+            await asyncio.sleep(2 ** attempt)
+        except Exception as e:
+            if _broadcasts_stopping:
+                # Failed because the bot is shutting down; leave the chat pending.
+                return None
+            logger.warning(f"Broadcast to {chat_id} failed: {e}")
+            BROADCAST_MESSAGES.inc("failed")
+            error_type, fatal, counts = classify_send_error(e)
+            await chat_health.failure(chat_id, error_type, fatal, counts)
+            return False
+    BROADCAST_MESSAGES.inc("failed")
+    await chat_health.failure(chat_id, "retries_exhausted")
+    return False
+
+def load_broadcast_jobs() -> dict:
+    jobs = read_json(BROADCAST_JOBS_FILE, {})
+    return jobs if isinstance(jobs, dict) else {}
+
+def save_broadcast_job(job: dict):
+    jobs = load_broadcast_jobs()
+    jobs[job["id"]] = job
+    write_json(BROADCAST_JOBS_FILE, jobs)
+
+def drop_broadcast_job(job_id: str):
+    jobs = load_broadcast_jobs()
+    if jobs.pop(job_id, None) is not None:
+        write_json(BROADCAST_JOBS_FILE, jobs)
+
+def broadcast_progress_text(job: dict, finished: bool = False) -> str:
+    total = job["total"]
+    done = job["sent"] + job["failed"]
+    head = "✅ Broadcast finished" if finished else "📣 Broadcasting..."
+    return f"{head}\n{done}/{total} processed\n✅ Sent: {job['sent']}, ❌ Failed: {job['failed']}"
+
+async def edit_broadcast_progress(bot, job: dict, finished: bool = False):
+    if not job.get("progress_msg_id"):
+        return
+    try:
+        await bot.edit_message_text(
+            chat_id=job["owner_chat"],
+            message_id=job["progress_msg_id"],
+            text=broadcast_progress_text(job, finished),
+        )
+    except Exception as e:
+        logger.debug("Progress edit failed: %s", e)
+
+async def run_broadcast(bot, job: dict):
+    send_priority.set(PRIORITY_BROADCAST)
+    pending = list(job["pending"])
+    done = set()
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    def checkpoint():
+        job["pending"] = [gid for gid in pending if gid not in done]
+        save_broadcast_job(job)
+
+    async def deliver(chat_id):
+        async with sem:
+            ok = await send_broadcast_item(bot, job, chat_id)
+        if ok is None:
+            return
+        if ok:
+            job["sent"] += 1
+        else:
+            job["failed"] += 1
+        done.add(chat_id)
+
+    async def report():
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            checkpoint()
+            await edit_broadcast_progress(bot, job)
+
+    reporter = asyncio.create_task(report())
+    sent_before, failed_before = job["sent"], job["failed"]
+    tasks = []
+    try:
+        # Upload media once: send to one chat at a time until Telegram hands
+        # back file_ids, then fan out the rest using them.
+        remaining = iter(pending)
+        for _ in range(BROADCAST_UPLOAD_ATTEMPTS):
+            chat_id = next(remaining, None) if media_needs_upload(job) else None
+            if chat_id is None:
+                break
+            await deliver(chat_id)
+        tasks = [asyncio.create_task(deliver(gid)) for gid in remaining]
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        checkpoint()
+        raise
+    finally:
+        reporter.cancel()
+        for task in tasks:
+            task.cancel()
+    drop_broadcast_job(job["id"])
+    await edit_broadcast_progress(bot, job, finished=True)
+    update_stats(sent_groups=job["sent"] - sent_before, failed_groups=job["failed"] - failed_before)
+    logger.info("Broadcast %s finished: sent=%s failed=%s", job["id"], job["sent"], job["failed"])
+    journal.record(
+        "broadcast", backend="telegram", job=job["id"], media=job["kind"], total=job["total"],
+        sent=job["sent"], failed=job["failed"],
+        latency_ms=round((time.time() - job["created"]) * 1000, 1),
+        outcome="ok" if job["failed"] == 0 else "partial",
+    )
+
+def start_broadcast_task(bot, job: dict):
+    async def runner():
+        try:
+            await run_broadcast(bot, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Broadcast %s crashed", job["id"])
+        finally:
+            _broadcast_tasks.pop(job["id"], None)
+
+    _broadcast_tasks[job["id"]] = asyncio.create_task(runner())
+
+async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, targets, kind: str, **payload):
+    job = {
+        "id": f"{int(time.time() * 1000)}",
+        "kind": kind,
+        "owner_chat": update.effective_chat.id,
+        "progress_msg_id": None,
+        "total": len(targets),
+        "sent": 0,
+        "failed": 0,
+        "pending": list(targets),
+        "created": time.time(),
+        **payload,
+    }
+    progress = await update.message.reply_text(broadcast_progress_text(job))
+    job["progress_msg_id"] = progress.message_id
+    save_broadcast_job(job)
+    start_broadcast_task(context.bot, job)
+
+def resume_broadcasts(bot):
+    global _broadcasts_stopping
+    _broadcasts_stopping = False
+    for job in load_broadcast_jobs().values():
+        if job["id"] in _broadcast_tasks:
+            continue
+        if job["kind"] in MEDIA_KINDS and isinstance(job.get("media"), str):
+            job["media"] = [{"type": job["kind"], "url": job["media"], "file_id": None}]
+        logger.info("Resuming broadcast %s (%s pending)", job["id"], len(job["pending"]))
+        start_broadcast_task(bot, job)
+
+async def stop_broadcasts():
+    global _broadcasts_stopping
+    _broadcasts_stopping = True
+    tasks = list(_broadcast_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+# ================= Paginated results =================
+TELEGRAM_TEXT_LIMIT = 4096
+
+def split_pages(body: str, size: int) -> list:
+    pages = []
+    while len(body) > size:
+        cut = body.rfind("\n", 0, size)
+        if cut < size // 2:
+            cut = size
+        pages.append(body[:cut])
+        body = body[cut:].lstrip("\n")
+    pages.append(body)
+    return pages
+
+class ResultStore:
+    """Long results kept server-side so paging never re-queries a backend."""
 
-async def fetch_chatgpt(client: httpx.AsyncClient, prompt: str):
-    url = CHATGPT_API_URL.format(prompt=prompt.replace(" ", "+"))
-    data = await fetch_json(client, url)
-    if isinstance(data, dict):
-        return data.get("reply") or data.get("response") or data.get("answer") or json.dumps(data)
-    return str(data)
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize, ttl)
 
-async def fetch_gemini3(client: httpx.AsyncClient, prompt: str):
-    try:
-        url = GEMINI3_API.format(prompt.replace(" ", "+"))
-        data = await fetch_json(client, url)
-        if isinstance(data, dict):
-            return data.get("response") or data.get("reply") or data.get("answer") or json.dumps(data)
-        return str(data)
-    except Exception as e:
-        logger.exception("Gemini3 fetch failed")
-        return f"Error: {e}"
+    def __len__(self):
+        return len(self._cache)
 
-async def fetch_deepseek(client: httpx.AsyncClient, prompt: str):
+    def put(self, result: dict) -> str:
+        # Random ids: a counter restarts after a reboot, so a button left on an
+        # old message could page through a different chat's result.
+        result_id = secrets.token_urlsafe(6)
+        while self._cache.get(result_id) is not None:
+            result_id = secrets.token_urlsafe(6)
+        self._cache.set(result_id, result)
+        return result_id
+
+    def get(self, result_id: str):
+        return self._cache.get(result_id)
+
+result_store = ResultStore(RESULT_STORE_MAX, RESULT_STORE_TTL)
+
+def render_page(result: dict, index: int) -> str:
+    page = result["pages"][index]
+    body = f"```\n{page}\n```" if result["code"] else page
+    footer = f"\n\n📄 Page {index + 1}/{len(result['pages'])}" if len(result["pages"]) > 1 else ""
+    return f"{result['header']}\n\n{body}{footer}"
+
+def page_keyboard(result_id: str, index: int, total: int):
+    if total <= 1:
+        return None
+    buttons = []
+    if index > 0:
+        buttons.append(InlineKeyboardButton("◀ Prev", callback_data=f"page:{result_id}:{index - 1}"))
+    buttons.append(InlineKeyboardButton(f"{index + 1}/{total}", callback_data="page:noop"))
+    if index < total - 1:
+        buttons.append(InlineKeyboardButton("Next ▶", callback_data=f"page:{result_id}:{index + 1}"))
+    return InlineKeyboardMarkup([buttons])
+
+async def edit_page(edit, result: dict, result_id, index: int):
+    # `edit` is message.edit_text or query.edit_message_text. Markdown that got
+    # split across pages may be invalid, so retry once as plain text.
+    markup = page_keyboard(result_id, index, len(result["pages"]))
+    text = render_page(result, index)
     try:
-        url = DEEPSEEK_API.format(prompt.replace(" ", "+"))
-        text = await fetch_text(client, url)
-        return text
+        await edit(text, parse_mode="Markdown", reply_markup=markup)
     except Exception as e:
-        logger.exception("DeepSeek fetch failed")
-        return f"Error: {e}"
+        if "not modified" in str(e).lower():
+            return
+        logger.warning(f"Markdown page edit failed, sending plain text: {e}")
+        await edit(text[:TELEGRAM_TEXT_LIMIT], reply_markup=markup)
 
-# ================= Broadcast Helpers =================
-def update_stats(sent_users=0, failed_users=0, sent_groups=0, failed_groups=0):
-    stats = read_json("stats.json", {"sent_users":0,"failed_users":0,"sent_groups":0,"failed_groups":0})
-    stats["sent_users"] += sent_users
-    stats["failed_users"] += failed_users
-    stats["sent_groups"] += sent_groups
-    stats["failed_groups"] += failed_groups
-    write_json("stats.json", stats)
+async def show_paged(msg, header: str, body: str, code: bool = False):
+    size = max(500, PAGE_CHARS - len(header))
+    result = {"header": header, "pages": split_pages(str(body), size), "code": code,
+              "chat_id": msg.chat_id, "message_id": msg.message_id}
+    result_id = result_store.put(result) if len(result["pages"]) > 1 else None
+    await edit_page(msg.edit_text, result, result_id, 0)
+
+async def handle_page_callback(query, data: str):
+    if data == "page:noop":
+        return
+    try:
+        _, result_id, index = data.split(":", 2)
+        index = int(index)
+    except ValueError:
+        return
+    result = result_store.get(result_id)
+    message = query.message
+    if result is None or message is None or (result["chat_id"], result["message_id"]) != (message.chat_id, message.message_id):
+        if message is not None:
+            await query.edit_message_reply_markup(reply_markup=None)
+            await message.reply_text("⌛ This result has expired, please ask again.")
+        return
+    index = max(0, min(index, len(result["pages"]) - 1))
+    await edit_page(query.edit_message_text, result, result_id, index)
 
 # ================= Commands =================
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await forward_or_copy(update, context, "/start")
     user = update.effective_user
-    users = read_json("users.json", [])
-    if user.id not in users:
-        users.append(user.id)
-        write_json("users.json", users)
+    await store.add_user(user.id)
 
     msg = (f"👤 <b>New User Started Bot</b>\n"
            f"Name: {user.full_name}\nUsername: @{user.username}\nID: <code>{user.id}</code>")
     try:
-        await context.bot.send_message(chat_id=OWNER_ID, text=msg, parse_mode="HTML")
+        with outbound_priority(PRIORITY_ALERT):
+            await context.bot.send_message(chat_id=OWNER_ID, text=msg, parse_mode="HTML")
     except Exception:
         pass
 
@@ -222,8 +2240,8 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Use the buttons below or commands:\n"
         "• /gemini <prompt>\n"
         "• /deepseek <prompt>\n"
-        "• /insta (or press button)\n"
-        "• /ff (or press button)\n"
+        "• /insta [usernames...] (or press button)\n"
+        "• /ff [UIDs...] (or press button)\n"
         "• /ping\n\n"
         "Tip: press a button and then send the prompt/username/uid as the next message ✅",
         reply_markup=keyboard,
@@ -249,12 +2267,24 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "🛠️ *Commands*\n"
         "• /gemini <prompt> - Gemini 3 AI\n"
         "• /deepseek <prompt> - DeepSeek 3.2 AI\n"
-        "• /ai <prompt> - Run ChatGPT + Gemini3 (combined)\n"
-        "• /insta - Get Instagram profile (bot will ask username)\n"
-        "• /ff - Free Fire player info (bot will ask UID)\n"
+        "• /ai [stream|race] <prompt> - Run ChatGPT + Gemini3 (combined)\n"
+        "• /insta [csv|json] [usernames...] - Instagram profile(s); bot asks if none given\n"
+        "• /ff [csv|json] [UIDs...] - Free Fire player info; several UIDs or a .txt list give a file\n"
         "• /ping - Bot status\n"
         "• /broadcast <group_id> <message> (owner only)\n"
         "• /broadcastall <message> (owner only)\n"
+        "• /broadcast_media [photo|video|document|album] <url...> <caption> (owner only)\n"
+        "• /cachestats [clear] - Lookup cache stats (owner only)\n"
+        "• /reloadkeywords - Reload keywords.json (owner only)\n"
+        "• /reloadroutes - Reload routes.json (owner only)\n"
+        "• /backends - Backend circuit/latency status (owner only)\n"
+        "• /health - Group delivery health (owner only)\n"
+        "• /aicache [stats|list|purge] - AI answer cache (owner only)\n"
+        "• /fresh <backend> <prompt> - Ask bypassing the cache (owner only)\n"
+        "• /sendq - Outbound send queue stats (owner only)\n"
+        "• /profile [cpu|sample] [seconds] [top] - Profile the bot (owner only)\n"
+        "• /memsnap [start|diff|stop] [top] - tracemalloc snapshots (owner only)\n"
+        "• /tasks [track on|off] [top] - Dump asyncio tasks with ages (owner only)\n"
     )
     await update.message.reply_text(help_text, parse_mode="Markdown")
 
@@ -266,9 +2296,8 @@ async def cmd_gemini(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     prompt = " ".join(context.args)
     msg = await update.message.reply_text("🤖 Gemini 3 is thinking... ⏳")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_gemini3(client, prompt)
-    await msg.edit_text(f"🧠 *Gemini 3 Response*\n\n{reply}", parse_mode="Markdown")
+    reply = await ask_ai("gemini", prompt, on_queued=queue_notice(msg, "🤖 Gemini 3 is thinking... ⏳"))
+    await show_paged(msg, "🧠 *Gemini 3 Response*", reply)
 
 async def cmd_deepseek(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await forward_or_copy(update, context, "/deepseek")
@@ -277,43 +2306,550 @@ async def cmd_deepseek(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     prompt = " ".join(context.args)
     msg = await update.message.reply_text("🚀 DeepSeek 3.2 is thinking... ⏳")
-    async with httpx.AsyncClient() as client:
-        reply = await fetch_deepseek(client, prompt)
-    await msg.edit_text(f"🔥 *DeepSeek 3.2 Response*\n\n{reply}", parse_mode="Markdown")
+    reply = await ask_ai("deepseek", prompt, on_queued=queue_notice(msg, "🚀 DeepSeek 3.2 is thinking... ⏳"))
+    await show_paged(msg, "🔥 *DeepSeek 3.2 Response*", reply)
+
+AI_COMBINED_BACKENDS = ("chatgpt", "gemini")
+AI_MODES = ("stream", "race")
+
+def render_ai_responses(replies: dict) -> str:
+    parts = []
+    for backend in AI_COMBINED_BACKENDS:
+        label = AI_BACKENDS[backend][0]
+        parts.append(f"*{label}:*\n{replies.get(backend, '⏳ waiting...')}")
+    return "\n\n".join(parts)
+
+async def ai_stream(msg, prompt: str):
+    async def labelled(backend):
+        return backend, await ask_ai(backend, prompt, hedge=True, on_queued=queued_notice(backend))
+
+    def queued_notice(backend):
+        # Shown in the backend's "waiting" slot so it never hides a finished reply.
+        async def notify(position: int):
+            if backend in replies:
+                return
+            queued[backend] = f"🕒 #{position} in the queue"
+            view = {**queued, **replies}
+            await msg.edit_text(f"💡 *AI Responses*\n\n{render_ai_responses(view)}", parse_mode="Markdown")
+        return notify
+
+    replies = {}
+    queued = {}
+    tasks = [asyncio.create_task(labelled(b)) for b in AI_COMBINED_BACKENDS]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            backend, reply = await next_done
+            replies[backend] = reply
+            if len(replies) == len(tasks):
+                break
+            text = f"💡 *AI Responses*\n\n{render_ai_responses(replies)}"
+            if len(text) > TELEGRAM_TEXT_LIMIT:
+                text = text[:TELEGRAM_TEXT_LIMIT - 1] + "…"
+            try:
+                await msg.edit_text(text, parse_mode="Markdown")
+            except Exception as e:
+                logger.warning(f"AI stream edit failed: {e}")
+    finally:
+        for task in tasks:
+            task.cancel()
+    await show_paged(msg, "💡 *AI Responses*", render_ai_responses(replies))
+
+async def ai_race(msg, prompt: str):
+    tasks = {
+        asyncio.create_task(ask_ai(
+            b, prompt, hedge=True, on_queued=queue_notice(msg, "🤖 Asking both AI engines... ⏳", AI_BACKENDS[b][0]),
+        )): b
+        for b in AI_COMBINED_BACKENDS
+    }
+    pending = set(tasks)
+    errors = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                reply = task.result()
+                label = AI_BACKENDS[tasks[task]][0]
+                if not is_error_reply(reply):
+                    await show_paged(msg, f"⚡ *{label}* (fastest)", reply)
+                    return
+                errors.append(f"*{label}:* {reply}")
+    finally:
+        for task in pending:
+            task.cancel()
+    await msg.edit_text("❌ All AI engines failed\n\n" + "\n".join(errors), parse_mode="Markdown")
 
 async def cmd_ai_combined(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await forward_or_copy(update, context, "/ai")
-    if not context.args:
-        await update.message.reply_text("💡 Usage: /ai <prompt> - runs ChatGPT + Gemini3", parse_mode="Markdown")
+    args = list(context.args or [])
+    mode = AI_DEFAULT_MODE
+    if args and args[0].lower() in AI_MODES:
+        mode = args.pop(0).lower()
+    if not args:
+        await update.message.reply_text("💡 Usage: /ai [stream|race] <prompt> - runs ChatGPT + Gemini3", parse_mode="Markdown")
         return
-    prompt = " ".join(context.args)
+    prompt = " ".join(args)
     msg = await update.message.reply_text("🤖 Asking both AI engines... ⏳")
-    async with httpx.AsyncClient() as client:
-        task1 = fetch_chatgpt(client, prompt)
-        task2 = fetch_gemini3(client, prompt)
-        chatgpt_reply, gemini_reply = await asyncio.gather(task1, task2)
-    text = f"💡 *AI Responses*\n\n*ChatGPT:*\n{chatgpt_reply}\n\n*Gemini 3:*\n{gemini_reply}"
-    await msg.edit_text(text, parse_mode="Markdown")
+    if mode == "race":
+        await ai_race(msg, prompt)
+    else:
+        await ai_stream(msg, prompt)
 
-# ================= Insta & FF helper flows (button or command) =================
+async def cmd_aicache(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id):
+        return
+    args = context.args or []
+    action = args[0].lower() if args else "stats"
+    if action == "purge":
+        backend = args[1].lower() if len(args) > 1 else None
+        removed = await prompt_cache.purge(backend)
+        await update.message.reply_text(f"🧹 Removed {removed} cached AI answers.")
+        return
+    if action == "list":
+        rows = await prompt_cache.top(10)
+        lines = ["🗂 <b>Recent cached prompts</b>"] + [
+            f"<b>{backend}</b>: {html.escape(prompt or '')}" for backend, prompt, _ in rows
+        ]
+        await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+        return
+    state = "on" if PROMPT_CACHE_ENABLED else "off (set PROMPT_CACHE=1)"
+    lines = [f"🗂 <b>AI prompt cache</b>: {state}"]
+    for backend, count, size in await prompt_cache.stats():
+        lines.append(
+            f"<b>{backend}</b>: {count} entries, {size // 1024} KB, "
+            f"hits {prompt_cache.hits.get(backend, 0)}, misses {prompt_cache.misses.get(backend, 0)}"
+        )
+    lines.append("Usage: /aicache [stats|list|purge [backend]], /fresh <backend> <prompt>")
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+
+async def cmd_fresh(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Owner-only: one request that skips the prompt cache (and refreshes it).
+    if not is_owner(update.effective_user.id):
+        return
+    args = context.args or []
+    if len(args) < 2 or args[0].lower() not in AI_BACKENDS:
+        await update.message.reply_text(f"Usage: /fresh <{'|'.join(AI_BACKENDS)}> <prompt>")
+        return
+    backend = args[0].lower()
+    prompt = " ".join(args[1:])
+    label = AI_BACKENDS[backend][0]
+    msg = await update.message.reply_text(f"🤖 {label} is thinking (uncached)... ⏳")
+    reply = await ask_ai(backend, prompt, use_cache=False)
+    await show_paged(msg, f"🧠 *{label} Response*", reply)
+
+async def cmd_health(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id):
+        return
+    records = store.health
+    dead = [cid for cid, r in records.items() if r["dead"]]
+    failing = [cid for cid, r in records.items() if not r["dead"] and r["consecutive_failures"]]
+    migrated = [cid for cid, r in records.items() if r["migrated_to"]]
+    by_error = {}
+    for cid in dead:
+        error = records[cid]["last_error"] or "unknown"
+        by_error[error] = by_error.get(error, 0) + 1
+    lines = [
+        "📡 <b>Delivery health</b>",
+        f"Groups tracked: {len(store.groups)} (live {len(chat_health.live_groups())})",
+        f"Dead chats: {len(dead)} ({DEAD_CHAT_POLICY})",
+        f"Failing (not yet dead): {len(failing)}",
+        f"Migrated to supergroup: {len(migrated)}",
+    ]
+    lines += [f"• {error}: {count}" for error, count in sorted(by_error.items())]
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+
+async def cmd_backends(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id):
+        return
+    lines = ["🩺 <b>Backends</b>"]
+    for name, breaker in breakers.items():
+        p95 = backend_latency[name].percentile(95)
+        p95_text = f"{p95:.2f}s" if p95 is not None else "n/a"
+        scheduler = ai_schedulers.get(name)
+        load = f", active {scheduler.active}/{scheduler.limit}, queued {scheduler.waiting}" if scheduler else ""
+        lines.append(f"<b>{name}</b>: {breaker.state}, failures {breaker.failures}, p95 {p95_text}{load}")
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+
+async def cmd_sendq(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id):
+        return
+    depths = outbound.depths()
+    lines = [f"📤 <b>Outbound queue</b> (in flight {outbound.inflight}/{outbound.concurrency}, {OUTBOUND_RATE:g}/s)"]
+    for priority, name in enumerate(PRIORITY_NAMES):
+        tracker = outbound.waits[priority]
+        p50, p95 = tracker.percentile(50), tracker.percentile(95)
+        wait = f"wait p50 {p50:.2f}s, p95 {p95:.2f}s" if p50 is not None else "no samples"
+        lines.append(f"<b>{name}</b>: queued {depths[name]}, {wait}, requeued {outbound.requeued[priority]}")
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+
+# ================= Profiling commands (owner only) =================
+class StackSampler:
+    """Statistical profiler: SIGPROF fires every `interval` seconds of CPU time
+    and the handler records the interrupted stack of the event loop thread."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = {}
+        self.total_counts = {}
+        self._previous = None
+        self._running = False
+
+    def start(self):
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self._running = True
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+
+    def _sample(self, signum, frame):
+        self.samples += 1
+        seen = set()
+        leaf = True
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+            if leaf:
+                self.self_counts[key] = self.self_counts.get(key, 0) + 1
+                leaf = False
+            if key not in seen:
+                seen.add(key)
+                self.total_counts[key] = self.total_counts.get(key, 0) + 1
+            frame = frame.f_back
+
+    def report(self, top: int) -> str:
+        def fmt(key):
+            filename, lineno, name = key
+            return f"{name} ({os.path.basename(filename)}:{lineno})"
+
+        lines = [f"{self.samples} samples, one per {self.interval * 1000:.0f} ms of CPU time", ""]
+        for title, counts in (("Self (leaf) samples", self.self_counts), ("Total (on stack) samples", self.total_counts)):
+            lines.append(title)
+            for key, count in sorted(counts.items(), key=lambda kv: kv[1], reverse=True)[:top]:
+                share = count / self.samples * 100 if self.samples else 0.0
+                lines.append(f"{count:8d} {share:6.1f}%  {fmt(key)}")
+            lines.append("")
+        return "\n".join(lines)
+
+_profile_task = None
+_profile_sampler = None
+
+async def run_profile(msg, mode: str, seconds: float, top: int):
+    global _profile_sampler
+    started = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    try:
+        if mode == "sample":
+            sampler = _profile_sampler = StackSampler(PROFILE_SAMPLE_INTERVAL)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                sampler.stop()
+                _profile_sampler = None
+            report = sampler.report(top)
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+            out = io.StringIO()
+            stats = pstats.Stats(profiler, stream=out)
+            stats.sort_stats("cumulative").print_stats(top)
+            stats.sort_stats("tottime").print_stats(top)
+            report = out.getvalue()
+        header = f"{mode} profile, {seconds:g}s, event loop thread only\n\n"
+        await msg.reply_document(
+            document=(header + report).encode("utf-8"),
+            filename=f"profile-{mode}-{started}.txt",
+            caption=f"🔬 {mode} profile ({seconds:g}s)",
+        )
+    except Exception:
+        logger.exception("Profiling failed")
+        await msg.reply_text("❌ Profiling failed, see the log.")
+
+async def cmd_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global _profile_task
+    if not is_owner(update.effective_user.id):
+        return
+    if _profile_task is not None and not _profile_task.done():
+        await update.message.reply_text("⏳ A profile is already running.")
+        return
+    args = list(context.args or [])
+    mode = args.pop(0).lower() if args and args[0].lower() in ("cpu", "sample") else "cpu"
+    if mode == "sample" and not hasattr(signal, "setitimer"):
+        await update.message.reply_text("❌ Sampling needs SIGPROF (Unix only); use /profile cpu.")
+        return
+    try:
+        seconds = min(PROFILE_MAX_SECONDS, max(1.0, float(args[0]))) if args else PROFILE_DEFAULT_SECONDS
+        top = int(args[1]) if len(args) > 1 else PROFILE_TOP
+    except ValueError:
+        await update.message.reply_text("Usage: /profile [cpu|sample] [seconds] [top]")
+        return
+    _profile_task = asyncio.create_task(run_profile(update.message, mode, seconds, top))
+    await update.message.reply_text(f"🔬 Profiling ({mode}) for {seconds:g}s...")
+
+async def stop_profiling():
+    global _profile_task
+    if _profile_task is not None:
+        _profile_task.cancel()
+        await asyncio.gather(_profile_task, return_exceptions=True)
+        _profile_task = None
+    if _profile_sampler is not None:
+        _profile_sampler.stop()
+
+_memsnap_baseline = None
+
+def memory_overview(app) -> list:
+    user_data = app.user_data
+    return [
+        f"user_data: {len(user_data)} users, {sum(len(d) for d in user_data.values())} keys",
+        f"pending flows: {len(conversations)} (expired {conversations.expired}, evicted {conversations.evicted})",
+        f"chat_data: {len(app.chat_data)} chats",
+        *(f"lookup cache {name}: {len(cache)} entries" for name, cache in lookup_caches.items()),
+        f"result store: {len(result_store)} results",
+        f"known users/groups: {len(store.users)}/{len(store.groups)}",
+        f"chat health rows: {len(store.health)}",
+        f"inbox queue: {inbox.queue.qsize()}",
+        f"outbound queue: {sum(outbound.depths().values())}",
+        f"asyncio tasks: {len(asyncio.all_tasks())}",
+    ]
+
+async def cmd_memsnap(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global _memsnap_baseline
+    if not is_owner(update.effective_user.id):
+        return
+    args = list(context.args or [])
+    action = args.pop(0).lower() if args and not args[0].isdigit() else "diff"
+    top = int(args[0]) if args and args[0].isdigit() else PROFILE_TOP
+    if action == "start":
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        _memsnap_baseline = tracemalloc.take_snapshot()
+        await update.message.reply_text("🧠 tracemalloc started, baseline taken. Use /memsnap diff later.")
+        return
+    if action == "stop":
+        tracemalloc.stop()
+        _memsnap_baseline = None
+        await update.message.reply_text("🧠 tracemalloc stopped.")
+        return
+    overview = memory_overview(context.application)
+    if not tracemalloc.is_tracing() or _memsnap_baseline is None:
+        await update.message.reply_text(
+            "🧠 Not tracing (use /memsnap start).\n" + "\n".join(overview)
+        )
+        return
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+    snapshot = tracemalloc.take_snapshot().filter_traces(ignore)
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"traced {current / 1024 / 1024:.1f} MiB, peak {peak / 1024 / 1024:.1f} MiB", "", *overview, "",
+             f"Top {top} growth since baseline (by line)"]
+    lines += [str(stat) for stat in snapshot.compare_to(_memsnap_baseline.filter_traces(ignore), "lineno")[:top]]
+    lines += ["", f"Top {top} allocations now (by traceback)"]
+    for stat in snapshot.statistics("traceback")[:top]:
+        lines.append(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks")
+        lines += [f"    {line}" for line in stat.traceback.format()]
+    await update.message.reply_document(
+        document="\n".join(lines).encode("utf-8"),
+        filename=f"memsnap-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.txt",
+        caption=f"🧠 Memory diff ({current / 1024 / 1024:.1f} MiB traced)",
+    )
+
+# Exact task ages need a task factory, installed only while tracking is on;
+# otherwise ages are lower bounds from when /tasks first saw each task.
+_task_born = weakref.WeakKeyDictionary()
+_task_seen = weakref.WeakKeyDictionary()
+
+def _tracking_task_factory(loop, coro, **kwargs):
+    task = asyncio.Task(coro, loop=loop, **kwargs)
+    _task_born[task] = time.monotonic()
+    return task
+
+def describe_task(task) -> str:
+    coro = task.get_coro()
+    name = getattr(coro, "__qualname__", type(coro).__name__)
+    where = ""
+    stack = task.get_stack(limit=1)
+    if stack:
+        frame = stack[-1]
+        where = f" at {frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+    return f"{task.get_name()} {name}{where}"
+
+async def cmd_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id):
+        return
+    args = list(context.args or [])
+    loop = asyncio.get_running_loop()
+    if args and args[0].lower() == "track":
+        enable = len(args) < 2 or args[1].lower() == "on"
+        loop.set_task_factory(_tracking_task_factory if enable else None)
+        await update.message.reply_text(f"🧵 Task age tracking {'on' if enable else 'off'}.")
+        return
+    top = int(args[0]) if args and args[0].isdigit() else 50
+    now = time.monotonic()
+    rows = []
+    for task in asyncio.all_tasks():
+        born = _task_born.get(task)
+        exact = born is not None
+        if not exact:
+            born = _task_seen.setdefault(task, now)
+        rows.append((now - born, exact, describe_task(task)))
+    rows.sort(key=lambda row: row[0], reverse=True)
+    lines = [f"{len(rows)} tasks, age tracking {'on' if loop.get_task_factory() is _tracking_task_factory else 'off'}"]
+    for age, exact, text in rows[:top]:
+        lines.append(f"{'' if exact else '>='}{age:8.1f}s  {text}")
+    report = "\n".join(lines)
+    if len(report) <= 3500:
+        await update.message.reply_text(f"<pre>{html.escape(report)}</pre>", parse_mode="HTML")
+    else:
+        await update.message.reply_document(document=report.encode("utf-8"), filename="tasks.txt",
+                                            caption=f"🧵 {len(rows)} tasks")
+
+# ================= Conversation state (AWAIT_* flows) =================
 AWAIT_GEMINI = "await_gemini"
 AWAIT_DEEPSEEK = "await_deepseek"
 AWAIT_INSTA = "await_insta"
 AWAIT_FF = "await_ff"
 
+class ConversationStates:
+    """One pending-flow slot per user. Entries expire after a TTL (swept in
+    the background), the oldest are evicted past a size cap, and changes are
+    written through to the conversation_state table so flows survive restarts."""
+
+    def __init__(self, ttl: float, max_users: int):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.expired = 0
+        self.evicted = 0
+        self._states = OrderedDict()  # user_id -> (state, expires_at), oldest first
+        self._task = None
+
+    def __len__(self):
+        return len(self._states)
+
+    async def load(self):
+        if not CONVERSATION_PERSIST:
+            return
+        now = time.time()
+        await store.execute("DELETE FROM conversation_state WHERE expires_at <= ?", (now,))
+        rows = await store.fetchall(
+            "SELECT user_id, state, expires_at FROM conversation_state ORDER BY expires_at"
+        )
+        for user_id, state, expires_at in rows[-self.max_users:]:
+            self._states[user_id] = (state, expires_at)
+
+    async def set(self, user_id: int, state: str):
+        expires_at = time.time() + self.ttl
+        self._states[user_id] = (state, expires_at)
+        self._states.move_to_end(user_id)
+        evicted = []
+        while len(self._states) > self.max_users:
+            evicted.append(self._states.popitem(last=False)[0])
+        self.evicted += len(evicted)
+        if CONVERSATION_PERSIST:
+            await store.execute(
+                "INSERT OR REPLACE INTO conversation_state (user_id, state, expires_at) VALUES (?, ?, ?)",
+                (user_id, state, expires_at),
+            )
+            for old in evicted:
+                await store.execute("DELETE FROM conversation_state WHERE user_id = ?", (old,))
+
+    async def pop(self, user_id: int):
+        entry = self._states.pop(user_id, None)
+        if entry is None:
+            return None
+        if CONVERSATION_PERSIST:
+            await store.execute("DELETE FROM conversation_state WHERE user_id = ?", (user_id,))
+        state, expires_at = entry
+        if expires_at <= time.time():
+            self.expired += 1
+            return None
+        return state
+
+    async def sweep(self) -> int:
+        # Every set() refreshes to the same TTL, so insertion order is expiry order.
+        now = time.time()
+        removed = 0
+        while self._states:
+            user_id, (_, expires_at) = next(iter(self._states.items()))
+            if expires_at > now:
+                break
+            del self._states[user_id]
+            removed += 1
+        self.expired += removed
+        if removed and CONVERSATION_PERSIST:
+            await store.execute("DELETE FROM conversation_state WHERE expires_at <= ?", (now,))
+        return removed
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(CONVERSATION_SWEEP_INTERVAL)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Conversation state sweep failed")
+
+conversations = ConversationStates(CONVERSATION_TTL, CONVERSATION_MAX_USERS)
+
+# ================= Insta & FF helper flows (button or command) =================
 async def start_insta_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message and (context.args or reply_document(update.message)):
+        await forward_or_copy(update, context, "/insta")
+        await dispatch_lookup(update, context, "insta", " ".join(context.args), reply_document(update.message))
+        return
     if update.message:
         await forward_or_copy(update, context, "/insta")
-        await update.message.reply_text("📸 Send Instagram username (e.g. zuck):")
+        await update.message.reply_text("📸 Send Instagram username(s) or a .txt list (e.g. zuck):")
     else:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="📸 Send Instagram username (e.g. zuck):")
-    context.user_data[AWAIT_INSTA] = True
+    await conversations.set(update.effective_user.id, AWAIT_INSTA)
+
+def insta_pic_key(username: str, pic_url: str) -> str:
+    # CDN URLs carry expiring signatures; the file name identifies the picture.
+    picture = pic_url.split("?", 1)[0].rsplit("/", 1)[-1]
+    digest = hashlib.sha1(picture.encode()).hexdigest()[:16]
+    return f"insta:{normalize_insta_username(username)}:{digest}"
+
+async def send_insta_photo(message, username: str, pic_url: str, caption: str) -> bool:
+    key = insta_pic_key(username, pic_url)
+    file_id = await store.get_file_id(key, max_age=INSTA_PIC_CACHE_TTL)
+    if file_id:
+        try:
+            await message.reply_photo(photo=file_id, caption=caption, parse_mode="Markdown")
+            return True
+        except Exception as e:
+            logger.warning(f"Cached Instagram file_id failed, re-uploading: {e}")
+            await store.delete_file_id(key)
+    try:
+        sent = await message.reply_photo(photo=pic_url, caption=caption, parse_mode="Markdown")
+    except Exception as e:
+        logger.warning(f"Instagram photo send failed: {e}")
+        return False
+    file_id = message_file_id(sent)
+    if file_id:
+        await store.put_file_id(key, file_id, "photo")
+        await store.prune_file_ids("insta:", INSTA_PIC_CACHE_MAX)
+    return True
 
 async def do_insta_fetch_by_text(update: Update, context: ContextTypes.DEFAULT_TYPE, username: str):
     msg = await update.message.reply_text("🔎 Fetching Instagram info...")
-    async with httpx.AsyncClient() as client:
-        data = await fetch_json(client, INSTA_API.format(username))
-    if not isinstance(data, dict) or data.get("status") != "ok":
+    data = await fetch_insta_profile(username)
+    if not insta_ok(data):
         await msg.edit_text("❌ Failed to fetch Instagram data.")
         return
     p = data.get("profile", {})
@@ -330,45 +2866,249 @@ async def do_insta_fetch_by_text(update: Update, context: ContextTypes.DEFAULT_T
     )
     pic = p.get("profile_pic_url_hd")
     try:
-        if pic:
+        if pic and await send_insta_photo(update.message, p.get("username") or username, pic, caption):
             await msg.delete()
-            await update.message.reply_photo(photo=pic, caption=caption, parse_mode="Markdown")
         else:
             await msg.edit_text(caption, parse_mode="Markdown")
     except Exception:
         await msg.edit_text(caption, parse_mode="Markdown")
 
 async def start_ff_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message and (context.args or reply_document(update.message)):
+        await forward_or_copy(update, context, "/ff")
+        await dispatch_lookup(update, context, "ff", " ".join(context.args), reply_document(update.message))
+        return
     if update.message:
         await forward_or_copy(update, context, "/ff")
-        await update.message.reply_text("🎮 Send Free Fire UID:")
+        await update.message.reply_text("🎮 Send Free Fire UID(s) or a .txt list:")
     else:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="🎮 Send Free Fire UID:")
-    context.user_data[AWAIT_FF] = True
+    await conversations.set(update.effective_user.id, AWAIT_FF)
 
 async def do_ff_fetch_by_text(update: Update, context: ContextTypes.DEFAULT_TYPE, uid: str):
     msg = await update.message.reply_text("🎯 Fetching Free Fire player info...")
-    async with httpx.AsyncClient() as client:
-        data = await fetch_json(client, FF_API.format(uid))
-    text = f"🎮 *Free Fire Player Info*\n\n```{json.dumps(data, indent=2)}```"
-    await msg.edit_text(text, parse_mode="Markdown")
+    data = await fetch_ff_player(uid)
+    await show_paged(msg, "🎮 *Free Fire Player Info*", json.dumps(data, indent=2, ensure_ascii=False), code=True)
+
+# ================= Batch lookups (many usernames / UIDs) =================
+LOOKUP_KINDS = {
+    "insta": ("Instagram", fetch_insta_profile, insta_ok, normalize_insta_username),
+    "ff": ("Free Fire", fetch_ff_player, ff_ok, normalize_ff_uid),
+}
+_batch_tasks = {}
+
+def reply_document(msg):
+    replied = msg.reply_to_message
+    return replied.document if replied is not None and replied.document else None
+
+def split_lookup_queries(text: str) -> list:
+    for sep in ",;|":
+        text = text.replace(sep, " ")
+    return text.split()
+
+async def dispatch_lookup(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, text: str, document=None):
+    tokens = split_lookup_queries(text or "")
+    fmt = None
+    if tokens and tokens[0].lower() in ("csv", "json"):
+        fmt = tokens.pop(0).lower()
+    if document is not None:
+        if document.file_size and document.file_size > BATCH_LOOKUP_FILE_MAX:
+            await update.message.reply_text(f"❌ List too large (max {BATCH_LOOKUP_FILE_MAX // 1024} KB).")
+            return
+        data = await (await document.get_file()).download_as_bytearray()
+        tokens += split_lookup_queries(bytes(data).decode("utf-8", "replace"))
+    if not tokens:
+        await update.message.reply_text("❌ Nothing to look up.")
+        return
+    if len(tokens) == 1 and fmt is None and document is None:
+        if kind == "insta":
+            await do_insta_fetch_by_text(update, context, tokens[0])
+        else:
+            await do_ff_fetch_by_text(update, context, tokens[0])
+        return
+    user_id = update.effective_user.id
+    running = _batch_tasks.get(user_id)
+    if running is not None and not running.done():
+        await update.message.reply_text("⏳ Your previous batch is still running.")
+        return
+    normalize = LOOKUP_KINDS[kind][3]
+    queries = [q for q in dict.fromkeys(normalize(t) for t in tokens) if q]
+    dropped = max(0, len(queries) - BATCH_LOOKUP_MAX)
+    queries = queries[:BATCH_LOOKUP_MAX]
+    start_batch_task(update.message, user_id, kind, queries, fmt or "csv", dropped)
+
+def start_batch_task(msg, user_id: int, kind: str, queries: list, fmt: str, dropped: int):
+    async def runner():
+        status = None
+        try:
+            status = await msg.reply_text(f"🔎 Checking {len(queries)} {LOOKUP_KINDS[kind][0]} accounts...")
+            await run_batch_lookup(msg, status, kind, queries, fmt, dropped)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Batch %s lookup for %s crashed", kind, user_id)
+            text = "❌ Batch lookup failed, please try again."
+            try:
+                if status is not None:
+                    await status.edit_text(text)
+                else:
+                    await msg.reply_text(text)
+            except Exception as e:
+                logger.debug("Batch failure notice failed: %s", e)
+        finally:
+            if _batch_tasks.get(user_id) is task:
+                del _batch_tasks[user_id]
+
+    task = asyncio.create_task(runner())
+    _batch_tasks[user_id] = task
+
+async def stop_batch_lookups():
+    tasks = list(_batch_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+def flatten_record(data: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_record(value, name + "."))
+        elif isinstance(value, list):
+            flat[name] = json.dumps(value, ensure_ascii=False)
+        else:
+            flat[name] = value
+    return flat
+
+def batch_csv(rows: list) -> bytes:
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue().encode("utf-8-sig")  # BOM so spreadsheet apps detect UTF-8
+
+async def run_batch_lookup(msg, status, kind: str, queries: list, fmt: str, dropped: int = 0):
+    label, fetch, is_ok, _ = LOOKUP_KINDS[kind]
+    started = time.monotonic()
+    sem = asyncio.Semaphore(BATCH_LOOKUP_CONCURRENCY)
+    results = {}
+    recent = deque(maxlen=5)
+
+    async def lookup(query):
+        async with sem:
+            data = await fetch(query)
+        ok = is_ok(data)
+        results[query] = (ok, data)
+        if not ok:
+            reason = data.get("error") if isinstance(data, dict) else None
+            recent.append(f"❌ {query}: {str(reason or 'not found')[:60]}")
+        elif kind == "insta":
+            recent.append(f"✅ @{query}: {data.get('profile', {}).get('followers')} followers")
+        else:
+            recent.append(f"✅ {query}")
+
+    def progress_text() -> str:
+        found = sum(1 for ok, _ in results.values() if ok)
+        return (f"🔎 {label}: {len(results)}/{len(queries)} checked "
+                f"(✅ {found} ❌ {len(results) - found})\n" + "\n".join(recent))
+
+    async def report_progress():
+        shown = None
+        while True:
+            await asyncio.sleep(BATCH_PROGRESS_INTERVAL)
+            text = progress_text()
+            if text != shown:
+                shown = text
+                try:
+                    await status.edit_text(text)
+                except Exception as e:
+                    logger.debug("Batch progress edit failed: %s", e)
+
+    reporter = asyncio.create_task(report_progress())
+    try:
+        await asyncio.gather(*(lookup(q) for q in queries))
+    finally:
+        reporter.cancel()
+    elapsed = time.monotonic() - started
+
+    if fmt == "json":
+        payload = json.dumps([{"query": q, "ok": results[q][0], "data": results[q][1]} for q in queries],
+                             indent=2, ensure_ascii=False).encode("utf-8")
+    else:
+        rows = []
+        for q in queries:
+            ok, data = results[q]
+            row = {"query": q, "status": "ok" if ok else "error"}
+            if ok:
+                row.update(flatten_record(data.get("profile", {}) if kind == "insta" else data))
+            else:
+                row["error"] = (data.get("error") or data.get("raw")) if isinstance(data, dict) else str(data)
+            rows.append(row)
+        payload = batch_csv(rows)
+    found = sum(1 for ok, _ in results.values() if ok)
+    summary = f"✅ {label}: {len(queries)} checked, {found} found, {len(queries) - found} failed in {elapsed:.1f}s"
+    if dropped:
+        summary += f"\n⚠️ {dropped} more skipped (max {BATCH_LOOKUP_MAX} per batch)"
+    try:
+        await status.edit_text(summary)
+    except Exception as e:
+        logger.debug("Batch summary edit failed: %s", e)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    await msg.reply_document(document=payload, filename=f"{kind}-{stamp}.{fmt}", caption=summary)
+
+async def cmd_cachestats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id):
+        return
+    if context.args and context.args[0] == "clear":
+        for cache in lookup_caches.values():
+            cache.clear()
+        await update.message.reply_text("🧹 Lookup caches cleared.")
+        return
+    lines = ["📊 <b>Lookup cache</b>"]
+    for name, cache in lookup_caches.items():
+        total = cache.hits + cache.misses
+        ratio = (cache.hits / total * 100) if total else 0.0
+        lines.append(
+            f"<b>{name}</b>: {len(cache)}/{cache.maxsize} entries, "
+            f"hits {cache.hits}, misses {cache.misses} ({ratio:.1f}% hit), "
+            f"coalesced {lookup_flights[name].coalesced}"
+        )
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+
+async def cmd_reloadroutes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id):
+        return
+    router.load()
+    await update.message.reply_text(
+        f"🔁 Routes: {len(router.users)} tracked users, {len(router.chats)} mirrored chats."
+    )
+
+async def cmd_reloadkeywords(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id):
+        return
+    keyword_watcher.reload(force=True)
+    await update.message.reply_text(f"🔁 Loaded {len(keyword_watcher.matcher.keywords)} keywords.")
 
 # ================= Callback Query Handler (buttons) =================
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
     await query.answer()
+    if data.startswith("page:"):
+        await handle_page_callback(query, data)
+        return
     if data == "btn_gemini":
-        context.user_data[AWAIT_GEMINI] = True
+        await conversations.set(query.from_user.id, AWAIT_GEMINI)
         await query.edit_message_text("🧠 Send your *Gemini 3* prompt now (just type message):", parse_mode="Markdown")
     elif data == "btn_deepseek":
-        context.user_data[AWAIT_DEEPSEEK] = True
+        await conversations.set(query.from_user.id, AWAIT_DEEPSEEK)
         await query.edit_message_text("🔥 Send your *DeepSeek 3.2* prompt now (just type message):", parse_mode="Markdown")
     elif data == "btn_insta":
-        context.user_data[AWAIT_INSTA] = True
+        await conversations.set(query.from_user.id, AWAIT_INSTA)
         await query.edit_message_text("📸 Send Instagram username (e.g. zuck):", parse_mode="Markdown")
     elif data == "btn_ff":
-        context.user_data[AWAIT_FF] = True
+        await conversations.set(query.from_user.id, AWAIT_FF)
         await query.edit_message_text("🎮 Send Free Fire UID:", parse_mode="Markdown")
     elif data == "btn_ping":
         await query.edit_message_text("🏓 Use /ping or press again if needed.")
@@ -383,36 +3123,32 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not msg or not msg.from_user:
         return
     user = msg.from_user
-    ud = context.user_data
+    state = await conversations.pop(user.id)
 
     # GEMINI via button
-    if ud.pop(AWAIT_GEMINI, False):
+    if state == AWAIT_GEMINI:
         prompt = msg.text or ""
         sent = await msg.reply_text("🤖 Gemini 3 is thinking... ⏳")
-        async with httpx.AsyncClient() as client:
-            reply = await fetch_gemini3(client, prompt)
-        await sent.edit_text(f"🧠 *Gemini 3 Response*\n\n{reply}", parse_mode="Markdown")
+        reply = await ask_ai("gemini", prompt, on_queued=queue_notice(sent, "🤖 Gemini 3 is thinking... ⏳"))
+        await show_paged(sent, "🧠 *Gemini 3 Response*", reply)
         return
 
     # DEEPSEEK via button
-    if ud.pop(AWAIT_DEEPSEEK, False):
+    if state == AWAIT_DEEPSEEK:
         prompt = msg.text or ""
         sent = await msg.reply_text("🚀 DeepSeek is thinking... ⏳")
-        async with httpx.AsyncClient() as client:
-            reply = await fetch_deepseek(client, prompt)
-        await sent.edit_text(f"🔥 *DeepSeek 3.2 Response*\n\n{reply}", parse_mode="Markdown")
+        reply = await ask_ai("deepseek", prompt, on_queued=queue_notice(sent, "🚀 DeepSeek is thinking... ⏳"))
+        await show_paged(sent, "🔥 *DeepSeek 3.2 Response*", reply)
         return
 
     # INSTA via button or command
-    if ud.pop(AWAIT_INSTA, False):
-        username = (msg.text or "").strip()
-        await do_insta_fetch_by_text(update, context, username)
+    if state == AWAIT_INSTA:
+        await dispatch_lookup(update, context, "insta", msg.text or msg.caption or "", msg.document)
         return
 
     # FF via button or command
-    if ud.pop(AWAIT_FF, False):
-        uid = (msg.text or "").strip()
-        await do_ff_fetch_by_text(update, context, uid)
+    if state == AWAIT_FF:
+        await dispatch_lookup(update, context, "ff", msg.text or msg.caption or "", msg.document)
         return
 
     # Forward private messages
@@ -421,57 +3157,35 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Keyword alerts
     if msg.text:
-        lowered = msg.text.lower()
-        for keyword in KEYWORDS:
+        matched = keyword_watcher.get().find(msg.text)
+        if matched:
+            alert = (
+                f"🚨 <b>Keyword Mention Detected!</b>\n"
+                f"<b>Keyword:</b> <code>{html.escape(', '.join(matched))}</code>\n"
+                f"<b>From:</b> {msg.from_user.full_name} (@{msg.from_user.username})\n"
+                f"<b>Chat:</b> {msg.chat.title if msg.chat.title else 'Private'}\n"
+                f"<b>Message:</b> {msg.text}"
+            )
             try:
-                if keyword.lower() in lowered:
-                    alert = (
-                        f"🚨 <b>Keyword Mention Detected!</b>\n"
-                        f"<b>Keyword:</b> <code>{keyword}</code>\n"
-                        f"<b>From:</b> {msg.from_user.full_name} (@{msg.from_user.username})\n"
-                        f"<b>Chat:</b> {msg.chat.title if msg.chat.title else 'Private'}\n"
-                        f"<b>Message:</b> {msg.text}"
-                    )
+                with outbound_priority(PRIORITY_ALERT):
                     await context.bot.send_message(chat_id=OWNER_ID, text=alert, parse_mode="HTML")
-                    break
             except Exception:
-                continue
-
-    # Tracked users forwarding
-    try:
-        if msg.from_user.id == TRACKED_USER1_ID:
-            await context.bot.send_message(chat_id=FORWARD_USER1_GROUP_ID,
-                                           text=f"📨 Message from tracked user in <b>{msg.chat.title}</b>",
-                                           parse_mode="HTML")
-            await msg.forward(chat_id=FORWARD_USER1_GROUP_ID)
-        if msg.from_user.id == TRACKED_USER2_ID:
-            await context.bot.send_message(chat_id=FORWARD_USER2_GROUP_ID,
-                                           text=f"📨 Message from tracked user in <b>{msg.chat.title}</b>",
-                                           parse_mode="HTML")
-            await msg.forward(chat_id=FORWARD_USER2_GROUP_ID)
-    except Exception:
-        logger.exception("Tracked forward failed")
+                logger.exception("Keyword alert failed")
 
-    # Source -> Destination
-    try:
-        if msg.chat.id == SOURCE_GROUP_ID:
-            try:
-                await msg.forward(chat_id=DESTINATION_GROUP_ID)
-            except Exception:
-                if msg.text:
-                    copy_text = f"📨 From: {msg.from_user.full_name} (@{msg.from_user.username})\nContent: {msg.text}"
-                    await context.bot.send_message(chat_id=DESTINATION_GROUP_ID, text=copy_text)
-    except Exception:
-        pass
+    # Tracked users / Source -> Destination
+    await route_message(context.bot, msg)
 
 # ================= Group Tracking Handler =================
 async def track_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat = update.my_chat_member.chat
+    member_update = update.my_chat_member
+    chat = member_update.chat
     if chat.type in ["group", "supergroup"]:
-        groups = read_json("groups.json", [])
-        if chat.id not in groups:
-            groups.append(chat.id)
-            write_json("groups.json", groups)
+        if member_update.new_chat_member.status in ("left", "kicked"):
+            await chat_health.failure(chat.id, "removed", fatal=True)
+            await store.remove_group(chat.id)
+        else:
+            await store.add_group(chat.id)
+            await chat_health.reset(chat.id)
 
 # ================= Broadcast Commands (owner only) =================
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -487,10 +3201,11 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     text = " ".join(context.args[1:])
     sent = failed = 0
-    try:
-        await context.bot.send_message(chat_id=group_id, text=text)
+    with outbound_priority(PRIORITY_BROADCAST):
+        delivered = await send_broadcast_item(context.bot, {"kind": "text", "text": text}, group_id, force=True)
+    if delivered:
         sent += 1
-    except:
+    else:
         failed += 1
     await update.message.reply_text(f"✅ Sent: {sent}, ❌ Failed: {failed}")
     update_stats(sent_groups=sent, failed_groups=failed)
@@ -502,74 +3217,475 @@ async def broadcastall(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /broadcastall <message>")
         return
     text = " ".join(context.args)
-    groups = read_json("groups.json", [])
-    sent = failed = 0
-    for gid in groups:
-        try:
-            await context.bot.send_message(chat_id=gid, text=text)
-            sent += 1
-        except:
-            failed += 1
-    await update.message.reply_text(f"✅ Sent: {sent}, ❌ Failed: {failed}")
-    update_stats(sent_groups=sent, failed_groups=failed)
+    await start_broadcast(update, context, chat_health.live_groups(), "text", text=text)
+
+BROADCAST_MEDIA_USAGE = (
+    "Usage: /broadcast_media [photo|video|document|album] <media_url> [more_urls...] <caption>\n"
+    "Or reply to a photo/video/document with /broadcast_media <caption>\n"
+    "Albums take 2-10 URLs."
+)
 
 async def broadcast_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_owner(update.effective_user.id):
         return
-    if len(context.args) < 2:
-        await update.message.reply_text("Usage: /broadcast_media <media_url> <caption>")
+    args = list(context.args or [])
+    kind = args.pop(0).lower() if args and args[0].lower() in MEDIA_KINDS else None
+    urls = []
+    while args and args[0].startswith(("http://", "https://")):
+        urls.append(args.pop(0))
+    caption = " ".join(args)
+
+    replied = update.message.reply_to_message
+    if not urls and replied is not None and message_file_id(replied):
+        # Re-broadcast media the owner already sent to the bot: no download at all.
+        media_type = next((t for t in ("photo", "video", "document") if getattr(replied, t)), None)
+        if media_type is None:
+            # Stickers, voice notes, audio etc. have file_ids that send_document rejects.
+            await update.message.reply_text("❌ Only photos, videos and documents can be broadcast.")
+            return
+        items = [{"type": media_type, "url": None, "file_id": message_file_id(replied)}]
+        kind = media_type
+        caption = caption or replied.caption or ""
+    elif urls:
+        items = [{"type": guess_media_type(url), "url": url, "file_id": None} for url in urls]
+        if kind is None:
+            kind = "album" if len(items) > 1 else items[0]["type"]
+        if kind != "album":
+            items = items[:1]
+            items[0]["type"] = kind
+        elif any(item["type"] == "document" for item in items):
+            # Telegram albums can't mix documents with photos/videos.
+            for item in items:
+                item["type"] = "document"
+    else:
+        await update.message.reply_text(BROADCAST_MEDIA_USAGE)
         return
-    media_url = context.args[0]
-    caption = " ".join(context.args[1:])
-    groups = read_json("groups.json", [])
-    sent = failed = 0
-    for gid in groups:
+    if kind == "album" and not 2 <= len(items) <= 10:
+        # send_media_group only accepts 2-10 items; every group would fail.
+        await update.message.reply_text(BROADCAST_MEDIA_USAGE)
+        return
+    await resolve_cached_media(items)
+    await start_broadcast(update, context, chat_health.live_groups(), kind, media=items, caption=caption)
+
+# ================= Update processing (per-chat ordering) =================
+def update_chat_key(update):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates from different chats concurrently (capped globally) while
+    updates from the same chat are handled strictly in arrival order, so the
+    AWAIT_* flows still see the button press before the follow-up message."""
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int):
+        # The base semaphore only bounds waiting updates; the real concurrency
+        # cap is taken after the chat lock so queued same-chat updates don't
+        # hold global slots.
+        super().__init__(max_pending_updates)
+        self.concurrency = max_concurrent_updates
+        self._global = None
+        self._chats = {}
+
+    async def initialize(self):
+        self._global = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self):
+        self._chats.clear()
+
+    async def do_process_update(self, update, coroutine):
+        if self._global is None:
+            await self.initialize()
+        key = update_chat_key(update)
+        if key is None:
+            async with self._global:
+                await coroutine
+            return
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
         try:
-            await context.bot.send_photo(chat_id=gid, photo=media_url, caption=caption)
-            sent += 1
-        except:
-            failed += 1
-    await update.message.reply_text(f"✅ Sent: {sent}, ❌ Failed: {failed}")
-    update_stats(sent_groups=sent, failed_groups=failed)
+            async with entry[0]:
+                async with self._global:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._chats.pop(key, None)
+
+# ================= Outbound send scheduler =================
+PRIORITY_USER, PRIORITY_ALERT, PRIORITY_FORWARD, PRIORITY_BROADCAST = range(4)
+PRIORITY_NAMES = ("user", "alert", "forward", "broadcast")
+# Handlers default to user priority; background workers set their own class.
+send_priority = contextvars.ContextVar("send_priority", default=PRIORITY_USER)
+
+@contextlib.contextmanager
+def outbound_priority(priority: int):
+    token = send_priority.set(priority)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+class OutboundJob:
+    __slots__ = ("call", "chat_id", "limited", "priority", "future", "enqueued", "attempts")
+
+    def __init__(self, call, chat_id, limited: bool, priority: int):
+        self.call = call
+        self.chat_id = chat_id
+        self.limited = limited
+        self.priority = priority
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+class OutboundScheduler(BaseRateLimiter):
+    """Rate limiter for every chat-bound Bot API call: strict priority classes,
+    round-robin across chats within a class, one global token bucket, per-chat
+    budgets for new group messages (edits only count globally) and requeueing on
+    RetryAfter instead of surfacing it to the caller."""
+
+    def __init__(self, rate: float, burst: float, concurrency: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.queues = [OrderedDict() for _ in PRIORITY_NAMES]
+        self.waits = [LatencyTracker(LATENCY_WINDOW) for _ in PRIORITY_NAMES]
+        self.requeued = [0] * len(PRIORITY_NAMES)
+        self.inflight = 0
+        self._chat_tokens = {}
+        self._blocked_until = {}
+        self._wake = None
+        self._slots = None
+        self._task = None
+        self._running = set()
+        self._stopping = False
+
+    async def initialize(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._stopping = False
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        # Same as Journal.stop: signal the dispatcher rather than cancel it
+        # while it is parked in wait_for().
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            for task in list(self._running):
+                task.cancel()
+            await asyncio.gather(*self._running, return_exceptions=True)
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for queue in self.queues:
+            for jobs in queue.values():
+                for job in jobs:
+                    job.future.cancel()
+            queue.clear()
+
+    def depths(self) -> dict:
+        return {name: sum(len(jobs) for jobs in self.queues[i].values()) for i, name in enumerate(PRIORITY_NAMES)}
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if self._task is None or chat_id is None:
+            return await callback(*args, **kwargs)
+        priority = rate_limit_args if isinstance(rate_limit_args, int) else send_priority.get()
+        limited = (
+            endpoint.startswith(("send", "forward", "copy")) and endpoint != "sendChatAction"
+            and not (isinstance(chat_id, int) and chat_id > 0)
+        )
+        job = OutboundJob(functools.partial(callback, *args, **kwargs), chat_id, limited, priority)
+        self._enqueue(job)
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            self._remove(job)
+            raise
+
+    def _enqueue(self, job: OutboundJob, front: bool = False):
+        jobs = self.queues[job.priority].setdefault(job.chat_id, deque())
+        if front:
+            jobs.appendleft(job)
+        else:
+            jobs.append(job)
+        self._wake.set()
+
+    def _remove(self, job: OutboundJob):
+        queue = self.queues[job.priority]
+        jobs = queue.get(job.chat_id)
+        if jobs and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del queue[job.chat_id]
+
+    def _chat_delay(self, job: OutboundJob, now: float) -> float:
+        delay = self._blocked_until.get(job.chat_id, 0.0) - now
+        if job.limited:
+            tokens, updated = self._chat_tokens.get(job.chat_id, (OUTBOUND_GROUP_BURST, now))
+            tokens = min(OUTBOUND_GROUP_BURST, tokens + (now - updated) * OUTBOUND_GROUP_RATE)
+            if tokens < 1:
+                delay = max(delay, (1 - tokens) / OUTBOUND_GROUP_RATE)
+        return delay
+
+    def _spend(self, job: OutboundJob, now: float):
+        if not job.limited:
+            return
+        tokens, updated = self._chat_tokens.get(job.chat_id, (OUTBOUND_GROUP_BURST, now))
+        tokens = min(OUTBOUND_GROUP_BURST, tokens + (now - updated) * OUTBOUND_GROUP_RATE)
+        self._chat_tokens[job.chat_id] = (tokens - 1, now)
+        if len(self._chat_tokens) > 10000:
+            refilled = now - OUTBOUND_GROUP_BURST / OUTBOUND_GROUP_RATE
+            self._chat_tokens = {c: v for c, v in self._chat_tokens.items() if v[1] > refilled}
+            self._blocked_until = {c: t for c, t in self._blocked_until.items() if t > now}
+
+    def _pick(self, now: float):
+        soonest = None
+        for queue in self.queues:
+            for chat_id, jobs in queue.items():
+                delay = self._chat_delay(jobs[0], now)
+                if delay <= 0:
+                    job = jobs.popleft()
+                    if jobs:
+                        queue.move_to_end(chat_id)
+                    else:
+                        del queue[chat_id]
+                    self._spend(job, now)
+                    return job, None
+                soonest = delay if soonest is None else min(soonest, delay)
+        return None, soonest
+
+    async def _next_job(self):
+        while not self._stopping:
+            self._wake.clear()
+            job, delay = self._pick(time.monotonic())
+            if job is not None:
+                return job
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    async def _dispatch(self):
+        while not self._stopping:
+            await self._slots.acquire()
+            job = None
+            try:
+                job = await self._next_job()
+                if job is not None:
+                    await self.bucket.acquire()
+            except Exception as e:
+                # Keep dispatching: a dead dispatcher would leave every later send waiting forever.
+                logger.exception("Outbound dispatch failed")
+                if job is not None and not job.future.done():
+                    job.future.set_exception(e)
+                job = None
+                await asyncio.sleep(0.1)
+            if job is None or self._stopping:
+                if job is not None:
+                    job.future.cancel()
+                self._slots.release()
+                continue
+            task = asyncio.create_task(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, job: OutboundJob):
+        self.inflight += 1
+        if job.attempts == 0:
+            waited = time.monotonic() - job.enqueued
+            self.waits[job.priority].observe(waited)
+            OUTBOUND_WAIT.observe(waited, PRIORITY_NAMES[job.priority])
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            job.attempts += 1
+            if job.attempts > OUTBOUND_MAX_RETRIES or job.future.done():
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self._blocked_until[job.chat_id] = time.monotonic() + _retry_seconds(e)
+                self.requeued[job.priority] += 1
+                OUTBOUND_REQUEUED.inc(PRIORITY_NAMES[job.priority])
+                self._enqueue(job, front=True)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.inflight -= 1
+            self._slots.release()
+
+outbound = OutboundScheduler(OUTBOUND_RATE, OUTBOUND_BURST, OUTBOUND_CONCURRENCY)
+OUTBOUND_WAIT = Histogram("hinata_outbound_wait_seconds", "Time Bot API calls spent in the send queue", ("priority",))
+OUTBOUND_REQUEUED = Counter("hinata_outbound_requeued_total", "Bot API calls requeued after RetryAfter", ("priority",))
+Gauge("hinata_outbound_queue_depth", "Bot API calls waiting in the send queue",
+      lambda: {(name,): depth for name, depth in outbound.depths().items()}, labels=("priority",))
+Gauge("hinata_outbound_inflight", "Bot API calls in flight through the send queue", lambda: outbound.inflight)
 
 # ================= Run Bot =================
-def main():
-    if not BOT_TOKEN:
-        logger.error("Bot token not found. Please put token in token.txt")
+async def post_init(app):
+    await store.open()
+    await conversations.load()
+    conversations.start()
+    open_http_clients()
+    if STATUS_SERVER_ENABLED or UPDATE_MODE == "webhook":
+        await status_server.start()
+    inbox.start(app.bot)
+    journal.start()
+    resume_broadcasts(app.bot)
+
+async def post_stop(app):
+    # Runs before app.shutdown() closes the Bot API client and the send
+    # scheduler, so in-flight broadcast sends and inbox forwards wind down
+    # while they can still reach Telegram, and before post_shutdown closes the
+    # backend clients that batch lookups use.
+    await stop_broadcasts()
+    await stop_batch_lookups()
+    await stop_profiling()
+    await inbox.stop()
+    await journal.stop()
+
+async def post_shutdown(app):
+    await status_server.stop()
+    await close_http_clients()
+    await conversations.stop()
+    await store.close()
+
+def webhook_secret() -> str:
+    return WEBHOOK_SECRET or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+
+def make_webhook_route(app):
+    secret = webhook_secret()
+
+    async def webhook_route(headers, body):
+        if headers.get("x-telegram-bot-api-secret-token") != secret:
+            return 403, "text/plain", b"forbidden"
+        try:
+            update = Update.de_json(json.loads(body), app.bot)
+        except Exception:
+            logger.exception("Bad webhook payload")
+            return 400, "text/plain", b"bad request"
+        await app.update_queue.put(update)
+        return 200, "text/plain", b"ok"
+
+    return webhook_route
+
+async def run_webhook(app):
+    if not WEBHOOK_URL:
+        logger.error("Webhook mode needs WEBHOOK_URL (or RENDER_EXTERNAL_URL)")
         return
+    status_server.route("POST", WEBHOOK_PATH, make_webhook_route(app))
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=webhook_secret(),
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=min(100, MAX_CONCURRENT_UPDATES * 2),
+        )
+        await app.start()
+        logger.info("Webhook set, waiting for updates on %s", WEBHOOK_PATH)
+        await stop_event.wait()
+    finally:
+        if app.running:
+            await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+def build_app(token: str, base_url: str = None):
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .request(InstrumentedRequest(connection_pool_size=TELEGRAM_POOL_SIZE))
+        .concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES))
+        .rate_limiter(outbound)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
 
     # Commands
-    app.add_handler(CommandHandler("start", cmd_start))
-    app.add_handler(CommandHandler("ping", cmd_ping))
-    app.add_handler(CommandHandler("help", cmd_help))
+    app.add_handler(CommandHandler("start", instrumented(cmd_start)))
+    app.add_handler(CommandHandler("ping", instrumented(cmd_ping)))
+    app.add_handler(CommandHandler("help", instrumented(cmd_help)))
 
     # AI
-    app.add_handler(CommandHandler("gemini", cmd_gemini))
-    app.add_handler(CommandHandler("deepseek", cmd_deepseek))
-    app.add_handler(CommandHandler("ai", cmd_ai_combined))
+    app.add_handler(CommandHandler("gemini", instrumented(cmd_gemini)))
+    app.add_handler(CommandHandler("deepseek", instrumented(cmd_deepseek)))
+    app.add_handler(CommandHandler("ai", instrumented(cmd_ai_combined)))
 
     # Insta / FF
-    app.add_handler(CommandHandler("insta", start_insta_flow))
-    app.add_handler(CommandHandler("ff", start_ff_flow))
+    app.add_handler(CommandHandler("insta", instrumented(start_insta_flow)))
+    app.add_handler(CommandHandler("ff", instrumented(start_ff_flow)))
 
     # Broadcasts
-    app.add_handler(CommandHandler("broadcast", broadcast))
-    app.add_handler(CommandHandler("broadcastall", broadcastall))
-    app.add_handler(CommandHandler("broadcast_media", broadcast_media))
+    app.add_handler(CommandHandler("broadcast", instrumented(broadcast)))
+    app.add_handler(CommandHandler("broadcastall", instrumented(broadcastall)))
+    app.add_handler(CommandHandler("broadcast_media", instrumented(broadcast_media)))
+
+    # Owner tools
+    app.add_handler(CommandHandler("cachestats", instrumented(cmd_cachestats)))
+    app.add_handler(CommandHandler("reloadkeywords", instrumented(cmd_reloadkeywords)))
+    app.add_handler(CommandHandler("reloadroutes", instrumented(cmd_reloadroutes)))
+    app.add_handler(CommandHandler("backends", instrumented(cmd_backends)))
+    app.add_handler(CommandHandler("health", instrumented(cmd_health)))
+    app.add_handler(CommandHandler("aicache", instrumented(cmd_aicache)))
+    app.add_handler(CommandHandler("fresh", instrumented(cmd_fresh)))
+    app.add_handler(CommandHandler("sendq", instrumented(cmd_sendq)))
+    app.add_handler(CommandHandler("profile", instrumented(cmd_profile)))
+    app.add_handler(CommandHandler("memsnap", instrumented(cmd_memsnap)))
+    app.add_handler(CommandHandler("tasks", instrumented(cmd_tasks)))
 
     # Callback button handler
-    app.add_handler(CallbackQueryHandler(callback_handler))
+    app.add_handler(CallbackQueryHandler(instrumented(callback_handler)))
 
     # Message handler
-    app.add_handler(MessageHandler(filters.ALL, handle_message))
+    app.add_handler(MessageHandler(filters.ALL, instrumented(handle_message)))
 
     # Track bot added to group
-    app.add_handler(ChatMemberHandler(track_group, ChatMemberHandler.MY_CHAT_MEMBER))
+    app.add_handler(ChatMemberHandler(instrumented(track_group), ChatMemberHandler.MY_CHAT_MEMBER))
+    return app
+
+def main():
+    if not BOT_TOKEN:
+        logger.error("Bot token not found. Please put token in token.txt")
+        return
 
-    logger.info("Hinata Bot starting...")
-    app.run_polling()
+    app = build_app(BOT_TOKEN)
+    logger.info("Hinata Bot starting (%s mode)...", UPDATE_MODE)
+    if UPDATE_MODE == "webhook":
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Offline aggregates over the bot's interaction journal (requests.jsonl).
+- Streams the hourly rollup, every sealed .jsonl.gz segment and the active
+  file line by line (rollup rows carry pre-aggregated counts; they have no
+  user/chat, so --by user only covers the raw segments)
+- Groups by user, backend, hour, kind or handler
+- Reports count, errors, avg/max latency and response bytes per group
+
+Examples:
+    python journal_query.py --by backend
+    python journal_query.py --by hour --kind ai --since 2026-10-01
+    python journal_query.py --by user --top 20 --json
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+DEFAULT_JOURNAL = "requests.jsonl"
+
+def journal_files(path: str) -> list:
+    stem, ext = os.path.splitext(path)
+    rollup = f"{stem}-hourly{ext}.gz"
+    files = [rollup] if os.path.exists(rollup) else []
+    files += sorted(glob.glob(f"{stem}.*{ext}.gz"))
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+def iter_records(path: str):
+    for file_path in journal_files(path):
+        opener = gzip.open if file_path.endswith(".gz") else open
+        with opener(file_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and "ts" in record:
+                    yield record
+
+def group_key(record: dict, by: str):
+    if by == "hour":
+        return datetime.fromtimestamp(record["ts"], timezone.utc).strftime("%Y-%m-%d %H:00")
+    if by == "user":
+        return record.get("user")
+    return record.get(by)
+
+def parse_since(value: str) -> float:
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+def aggregate(records, by: str, kind=None, since=None) -> dict:
+    groups = {}
+    for record in records:
+        if kind and record.get("kind") != kind:
+            continue
+        if since and record["ts"] < since:
+            continue
+        key = group_key(record, by)
+        stats = groups.get(key)
+        if stats is None:
+            stats = groups[key] = {"count": 0, "errors": 0, "latency_sum": 0.0, "latency_max": 0.0,
+                                   "latency_n": 0, "bytes": 0}
+        if record.get("rollup"):
+            stats["count"] += record.get("count", 0)
+            stats["errors"] += record.get("errors", 0)
+            stats["latency_sum"] += record.get("latency_sum", 0.0)
+            stats["latency_n"] += record.get("latency_n", 0)
+            stats["latency_max"] = max(stats["latency_max"], record.get("latency_max", 0.0))
+            stats["bytes"] += record.get("bytes", 0)
+            continue
+        stats["count"] += 1
+        if record.get("outcome") not in (None, "ok"):
+            stats["errors"] += 1
+        latency = record.get("latency_ms")
+        if isinstance(latency, (int, float)):
+            stats["latency_sum"] += latency
+            stats["latency_n"] += 1
+            stats["latency_max"] = max(stats["latency_max"], latency)
+        size = record.get("size")
+        if isinstance(size, int):
+            stats["bytes"] += size
+    return groups
+
+def summarize(groups: dict, by: str, top: int) -> list:
+    rows = []
+    for key, stats in groups.items():
+        n = stats["latency_n"]
+        rows.append({
+            by: key,
+            "count": stats["count"],
+            "errors": stats["errors"],
+            "avg_latency_ms": round(stats["latency_sum"] / n, 1) if n else None,
+            "max_latency_ms": round(stats["latency_max"], 1) if n else None,
+            "bytes": stats["bytes"],
+        })
+    if by == "hour":
+        rows.sort(key=lambda r: r[by])
+    else:
+        rows.sort(key=lambda r: r["count"], reverse=True)
+    return rows[:top] if top else rows
+
+def print_table(rows: list, by: str):
+    if not rows:
+        print("No matching records.")
+        return
+    columns = [by, "count", "errors", "avg_latency_ms", "max_latency_ms", "bytes"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row[c]).rjust(widths[c]) for c in columns))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate the Hinata interaction journal.")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL, help="active journal file (segments are found next to it)")
+    parser.add_argument("--by", default="backend", choices=["user", "backend", "hour", "kind", "handler", "chat"])
+    parser.add_argument("--kind", help="only records of this kind (update, ai, lookup, broadcast)")
+    parser.add_argument("--since", help="only records at or after this UTC date/time (ISO format)")
+    parser.add_argument("--top", type=int, default=0, help="limit output to the N largest groups")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    args = parser.parse_args(argv)
+
+    since = parse_since(args.since) if args.since else None
+    groups = aggregate(iter_records(args.journal), args.by, args.kind, since)
+    rows = summarize(groups, args.by, args.top)
+    if args.json:
+        json.dump(rows, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+    else:
+        print_table(rows, args.by)
+
+if __name__ == "__main__":
+    main()